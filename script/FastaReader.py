@@ -2,15 +2,19 @@ from __future__ import absolute_import
 
 
 from builtins import next
-from builtins import range
 from builtins import object
 from os.path import abspath, expanduser
 from io_io import NativeIO as StringIO
-from io_io import FilePercenter
+from io_io import FilePercenter, filesize
+import gzip_io
+import collections
 import contextlib
-import gzip
+import itertools
 import logging
 import md5
+import mmap as mmap_module
+import numbers
+import os
 import re
 import subprocess
 import sys
@@ -23,8 +27,21 @@ LOG = logging.getLogger(__name__)
 
 
 def wrap(s, columns):
-    return "\n".join(s[start:start + columns]
-                     for start in range(0, len(s), columns))
+    # The builtins.range from 'future' is slow to iterate on Python 2,
+    # and join() of a list is faster than of a generator.
+    starts = itertools.islice(itertools.count(0, columns), (len(s) + columns - 1) // columns)
+    return "\n".join([s[start:start + columns] for start in starts])
+
+
+def strip_newlines(raw, crlf=False):
+    """
+    Remove the line endings from sequence lines. (For this, str.replace()
+    is several times faster than str.translate() or splitlines()/join().)
+    """
+    raw = raw.replace('\n', '')
+    if crlf:
+        raw = raw.replace('\r', '')
+    return raw
 
 
 def splitFastaHeader(name):
@@ -59,13 +76,76 @@ def splitFileContents(f, delimiter, BLOCKSIZE=8192):
     yield remainder.getvalue()
 
 
-class FastaRecord(object):
+class BaseFastaRecord(object):
     """
-    A FastaRecord object models a named sequence in a FASTA file.
+    Accessors shared by FastaRecord and CompactFastaRecord, which store
+    the name and sequence as _name and _sequence.
     """
+    __slots__ = ()
+
     DELIMITER = ">"
     COLUMNS = 60
 
+    @property
+    def name(self):
+        """
+        The name of the sequence in the FASTA file, equal to the entire
+        FASTA header following the '>' character
+        """
+        return self._name
+
+    @property
+    def sequence(self):
+        """
+        The sequence for the record as present in the FASTA file.
+        (Newlines are removed but otherwise no sequence normalization
+        is performed).
+        """
+        return self._sequence
+
+    @property
+    def length(self):
+        """
+        Get the length of the FASTA sequence
+        """
+        return len(self._sequence)
+
+    @classmethod
+    def fromString(cls, s):
+        """
+        Interprets a string as a FASTA record.  Does not make any
+        assumptions about wrapping of the sequence string.
+        """
+        try:
+            lines = s.splitlines()
+            assert len(lines) > 1
+            assert lines[0][0] == cls.DELIMITER
+            name = lines[0][1:]
+            sequence = "".join(lines[1:])
+            return cls(name, sequence)
+        except AssertionError:
+            raise ValueError("String not recognized as a valid FASTA record")
+
+    def __eq__(self, other):
+        return records_equal(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        """
+        Output a string representation of this FASTA record, observing
+        standard conventions about sequence wrapping.
+        """
+        return (">%s\n" % self.name) + \
+            wrap(self.sequence, self.COLUMNS)
+
+
+class FastaRecord(BaseFastaRecord):
+    """
+    A FastaRecord object models a named sequence in a FASTA file.
+    """
+
     def __init__(self, name, sequence):
         try:
             assert "\n" not in name
@@ -79,12 +159,43 @@ class FastaRecord(object):
             raise ValueError("Invalid FASTA record data")
 
     @property
-    def name(self):
+    def id(self):
         """
-        The name of the sequence in the FASTA file, equal to the entire
-        FASTA header following the '>' character
+        The id of the sequence in the FASTA file, equal to the FASTA header
+        up to the first whitespace.
         """
-        return self._name
+        return self._id
+
+    @property
+    def metadata(self):
+        """
+        The metadata associated with the sequence in the FASTA file, equal to
+        the contents of the FASTA header following the first whitespace
+        """
+        return self._metadata
+
+    @property
+    def md5(self):
+        """
+        The MD5 checksum (hex digest) of `sequence`
+        """
+        return self._md5
+
+
+class CompactFastaRecord(BaseFastaRecord):
+    """
+    A CompactFastaRecord is a slotted FastaRecord for bulk parsing.
+    The header is split into id/metadata, and the md5 is computed,
+    only on first access. No validation is done here; the parser
+    already guarantees a well-formed record.
+    """
+    __slots__ = ('_name', '_sequence', '_md5', '_id_metadata')
+
+    def __init__(self, name, sequence):
+        self._name = name
+        self._sequence = sequence
+        self._md5 = None
+        self._id_metadata = None
 
     @property
     def id(self):
@@ -92,7 +203,9 @@ class FastaRecord(object):
         The id of the sequence in the FASTA file, equal to the FASTA header
         up to the first whitespace.
         """
-        return self._id
+        if self._id_metadata is None:
+            self._id_metadata = splitFastaHeader(self._name)
+        return self._id_metadata[0]
 
     @property
     def metadata(self):
@@ -100,72 +213,213 @@ class FastaRecord(object):
         The metadata associated with the sequence in the FASTA file, equal to
         the contents of the FASTA header following the first whitespace
         """
-        return self._metadata
+        if self._id_metadata is None:
+            self._id_metadata = splitFastaHeader(self._name)
+        return self._id_metadata[1]
+
+    @property
+    def md5(self):
+        """
+        The MD5 checksum (hex digest) of `sequence`
+        """
+        if self._md5 is None:
+            self._md5 = md5.md5(self._sequence).hexdigest()
+        return self._md5
+
+
+class FastaRecordView(object):
+    """
+    A FastaRecordView models a named sequence in a memory-mapped FASTA file,
+    without copying it. Only offsets are stored; the name is sliced on first
+    access and the sequence is built only when `sequence` is requested.
+
+    The view is only valid while the underlying map is open.
+    """
+    __slots__ = ('_map', 'offset', 'seq_offset', 'end', '_name', '_length')
+
+    DELIMITER = ">"
+    COLUMNS = 60
+
+    def __init__(self, mapped, offset, seq_offset, end):
+        """
+        mapped: mmap (or str) - the entire FASTA file
+        offset: int - position of the '>' of this record
+        seq_offset: int - position just after the header line
+        end: int - position just after the last sequence line
+        """
+        self._map = mapped
+        self.offset = offset
+        self.seq_offset = seq_offset
+        self.end = end
+        self._name = None
+        self._length = None
+
+    @property
+    def name(self):
+        """
+        The name of the sequence in the FASTA file, equal to the entire
+        FASTA header following the '>' character
+        """
+        if self._name is None:
+            self._name = self._map[self.offset + 1:self.seq_offset - 1].rstrip('\r')
+        return self._name
+
+    @property
+    def id(self):
+        return splitFastaHeader(self.name)[0]
+
+    @property
+    def metadata(self):
+        return splitFastaHeader(self.name)[1]
 
     @property
     def sequence(self):
         """
-        The sequence for the record as present in the FASTA file.
-        (Newlines are removed but otherwise no sequence normalization
-        is performed).
+        The sequence, with newlines removed. This copies the bytes
+        out of the map on each call.
         """
-        return self._sequence
+        return strip_newlines(self._map[self.seq_offset:self.end], self._crlf)
 
     @property
     def length(self):
         """
-        Get the length of the FASTA sequence
+        Get the length of the FASTA sequence, without keeping a copy of it.
         """
-        return len(self._sequence)
+        if self._length is None:
+            raw = self._map[self.seq_offset:self.end]
+            self._length = len(raw) - raw.count('\n')
+            if self._crlf:
+                self._length -= raw.count('\r')
+        return self._length
 
     @property
     def md5(self):
         """
         The MD5 checksum (hex digest) of `sequence`
         """
-        return self._md5
+        return md5.md5(self.sequence).hexdigest()
 
-    @classmethod
-    def fromString(cls, s):
+    @property
+    def _crlf(self):
+        return self._map[self.seq_offset - 2:self.seq_offset - 1] == '\r'
+
+    @property
+    def raw(self):
         """
-        Interprets a string as a FASTA record.  Does not make any
-        assumptions about wrapping of the sequence string.
+        The record exactly as it appears in the file, header included.
         """
-        try:
-            lines = s.splitlines()
-            assert len(lines) > 1
-            assert lines[0][0] == cls.DELIMITER
-            name = lines[0][1:]
-            sequence = "".join(lines[1:])
-            return FastaRecord(name, sequence)
-        except AssertionError:
-            raise ValueError("String not recognized as a valid FASTA record")
+        return self._map[self.offset:self.end]
 
-    def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return (self.name == other.name and
-                    self.sequence == other.sequence)
-        else:
+    def is_formatted(self, columns=COLUMNS):
+        """
+        True if `raw` is exactly str(self) + '\\n' for this wrapping
+        (0 for unwrapped), so the bytes can be copied instead of reformatted.
+        """
+        if self._crlf or self.end <= self.seq_offset:
             return False
+        raw = self._map[self.seq_offset:self.end]
+        if raw[-1:] != '\n':
+            return False
+        if not columns:
+            return raw.find('\n') == len(raw) - 1
+        # Every full line must end on the grid, and there must be no other newlines.
+        nlines = raw.count('\n')
+        length = len(raw) - nlines
+        line_ends = raw[columns::columns + 1]
+        return (nlines == (length + columns - 1) // columns and
+                len(line_ends) == length // columns and
+                line_ends == '\n' * len(line_ends))
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        return records_equal(self, other)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __str__(self):
-        """
-        Output a string representation of this FASTA record, observing
-        standard conventions about sequence wrapping.
-        """
         return (">%s\n" % self.name) + \
             wrap(self.sequence, self.COLUMNS)
 
 
+def records_equal(a, b):
+    """Any two records (FastaRecord, CompactFastaRecord or FastaRecordView)
+    are equal if their names and sequences are.
+    """
+    if isinstance(b, (BaseFastaRecord, FastaRecordView)):
+        return (a.name == b.name and
+                a.sequence == b.sequence)
+    else:
+        return False
+
+
+class FastaWriter(object):
+    """
+    Write FASTA records to a file-object, batched into large writes.
+
+    columns: sequence line width, or 0 for unwrapped (e.g. for fasta2DB,
+    which does not care).
+
+    A FastaRecordView already formatted that way is copied byte-for-byte.
+    Call flush() (or use as a context manager) when done.
+    """
+    BUFSIZE = 4 * 2**20
+
+    def __init__(self, fp, columns=FastaRecord.COLUMNS, bufsize=BUFSIZE):
+        self.fp = fp
+        self.columns = columns
+        self.bufsize = bufsize
+        self._parts = []
+        self._nbytes = 0
+
+    def _append(self, data):
+        self._parts.append(data)
+        self._nbytes += len(data)
+        if self._nbytes >= self.bufsize:
+            self.flush()
+
+    def write_raw(self, data):
+        """
+        Write already-formatted FASTA text.
+        """
+        self._append(data)
+
+    def write_record(self, record):
+        """
+        record: anything with name and sequence, e.g. a FastaRecordView
+        """
+        if isinstance(record, FastaRecordView) and record.is_formatted(self.columns):
+            self._append(record.raw)
+            return
+        sequence = record.sequence
+        if self.columns and len(sequence) > self.columns:
+            sequence = wrap(sequence, self.columns)
+        self._append(">%s\n" % record.name)
+        self._append(sequence)
+        self._append("\n")
+
+    def flush(self):
+        if self._parts:
+            self.fp.write("".join(self._parts))
+            self._parts = []
+            self._nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
 # These are refactored from ReaderBase/FastaReader.
 
-def yield_fasta_records(f, fn, log=LOG.info):
+def yield_fasta_records(f, fn, log=LOG.info, record_class=CompactFastaRecord):
     """
     f: fileobj
     fn: str - filename (for exceptions)
+    record_class: FastaRecord for eager md5 and header validation
     """
     counter = FilePercenter(fn, log=log)
     try:
@@ -173,11 +427,203 @@ def yield_fasta_records(f, fn, log=LOG.info):
         assert "" == next(parts)
         for part in parts:
             counter(len(part))
-            yield FastaRecord.fromString(">" + part)
+            yield record_class.fromString(">" + part)
     except AssertionError:
         raise Exception("Invalid FASTA file {!r}".format(fn))
 
 
+DEFAULT_BLOCKSIZE = 16 * 2**20
+
+
+def yield_fasta_records_from_blocks(f, fn, log=LOG.info, blocksize=DEFAULT_BLOCKSIZE,
+                                    record_class=CompactFastaRecord):
+    """
+    f: fileobj
+    fn: str - filename (for exceptions)
+    blocksize: int - bytes per read() (4-64MB is typical)
+
+    Same records as yield_fasta_records(), but parsed from large blocks
+    with find() and replace(), instead of per-record splitting and joining.
+    A record split across blocks is carried over into the next block.
+    """
+    counter = FilePercenter(fn, log=log)
+    carry = ''
+    first = True
+    while True:
+        block = f.read(blocksize)
+        if not block:
+            break
+        data = carry + block if carry else block
+        if first:
+            if data[0:1] != ">":
+                raise Exception("Invalid FASTA file {!r}".format(fn))
+            first = False
+        # Everything before the last record-start is complete.
+        last = _rfind_record_start(data, len(data))
+        if last <= 0:
+            carry = data
+            continue
+        for record in _yield_records_in(data, 0, last, fn, record_class):
+            yield record
+        counter(last)
+        carry = data[last:]
+    if carry:
+        for record in _yield_records_in(carry, 0, len(carry), fn, record_class):
+            yield record
+        counter(len(carry))
+
+
+def _find_record_start(data, start, end):
+    """Return the position of the next '>' at the start of a line
+    in data[start:end], or -1.
+    (A single-char find() is about twice as fast as find('\\n>').)
+    """
+    pos = data.find(">", start, end)
+    while pos > 0 and data[pos - 1] != "\n":
+        pos = data.find(">", pos + 1, end)
+    return pos
+
+
+def _rfind_record_start(data, end):
+    pos = data.rfind(">", 0, end)
+    while pos > 0 and data[pos - 1] != "\n":
+        pos = data.rfind(">", 0, pos)
+    return pos
+
+
+def _yield_records_in(data, offset, size, fn, record_class):
+    """Yield records from data[offset:size], which holds only whole records.
+    """
+    while offset < size:
+        header_end = data.find("\n", offset, size)
+        if header_end < 0:
+            raise Exception("Invalid FASTA file {!r}: no sequence for record {!r}".format(
+                fn, data[offset:offset + 80]))
+        next_offset = _find_record_start(data, header_end, size)
+        end = size if next_offset < 0 else next_offset
+        crlf = data[header_end - 1:header_end] == "\r"
+        name = data[offset + 1:header_end - 1] if crlf else data[offset + 1:header_end]
+        sequence = strip_newlines(data[header_end + 1:end], crlf)
+        yield record_class(name, sequence)
+        offset = end
+
+
+def yield_mmap_fasta_records(mapped, fn, log=LOG.info):
+    """
+    mapped: mmap (or str) - the entire FASTA file
+    fn: str - filename (for exceptions)
+
+    Yield a FastaRecordView for each record. Records start at a '>'
+    at the beginning of a line.
+    """
+    size = len(mapped)
+    if not size:
+        return
+    counter = FilePercenter(fn, log=log)
+    if mapped[0:1] != ">":
+        raise Exception("Invalid FASTA file {!r}".format(fn))
+    offset = 0
+    while offset < size:
+        header_end = mapped.find("\n", offset)
+        if header_end < 0:
+            raise Exception("Invalid FASTA file {!r}: no sequence for record at byte {}".format(
+                fn, offset))
+        next_offset = _find_record_start(mapped, header_end, size)
+        if next_offset < 0:
+            end = size
+        else:
+            end = next_offset
+        counter(end - offset)
+        yield FastaRecordView(mapped, offset, header_end + 1, end)
+        offset = end
+
+
+def view_at(mapped, offset):
+    """Return the FastaRecordView of the record starting at offset,
+    e.g. an offset remembered from an earlier pass.
+    """
+    size = len(mapped)
+    header_end = mapped.find("\n", offset)
+    if header_end < 0:
+        raise Exception("No FASTA record at byte {}".format(offset))
+    next_offset = _find_record_start(mapped, header_end, size)
+    end = size if next_offset < 0 else next_offset
+    return FastaRecordView(mapped, offset, header_end + 1, end)
+
+
+def view_before(mapped, offset):
+    """Return the FastaRecordView of the record before the one at offset,
+    or None if there is none.
+    """
+    pos = _rfind_record_start(mapped, offset)
+    return view_at(mapped, pos) if pos >= 0 else None
+
+
+def yield_views_starting_in(mapped, start, end):
+    """Yield a FastaRecordView for each record whose '>' is in mapped[start:end].
+    The last may extend past end. Used to sample byte ranges of a file.
+    """
+    pos = _find_record_start(mapped, start, end)
+    while 0 <= pos < end:
+        view = view_at(mapped, pos)
+        yield view
+        pos = view.end if view.end < end else -1
+
+
+@contextlib.contextmanager
+def open_mmap(fn):
+    """Map a plain file read-only.
+    Yield the map, or '' for an empty file (which cannot be mapped).
+    """
+    with open(fn, 'rb') as ifs:
+        if not filesize(fn):
+            yield ''
+            return
+        mapped = mmap_module.mmap(ifs.fileno(), 0, access=mmap_module.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+class RangeReader(object):
+    """
+    Read-only view of bytes [start, end) of an open file,
+    e.g. one shard from get_fasta_shards().
+    """
+
+    def __init__(self, f, start, end):
+        f.seek(start)
+        self.f = f
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def get_fasta_shards(fn, shard_bytes):
+    """
+    Split plain FASTA file fn into byte-ranges of about shard_bytes each,
+    every one starting at a record ('>' at the start of a line).
+    Return [(start, end), ...], covering the whole file in order.
+    """
+    with open_mmap(fn) as mapped:
+        size = len(mapped)
+        shards = list()
+        start = 0
+        while start < size:
+            end = _find_record_start(mapped, start + max(shard_bytes, 1), size)
+            if end < 0:
+                end = size
+            shards.append((start, end))
+            start = end
+    return shards
+
+
 def stream_stdout(call, fn):
     args = call.split()
     proc = subprocess.Popen(args, stdin=open(fn), stdout=subprocess.PIPE)
@@ -185,9 +631,14 @@ def stream_stdout(call, fn):
 
 
 @contextlib.contextmanager
-def open_fasta_reader(fn, log=LOG.info):
+def open_fasta_reader(fn, log=LOG.info, mmap=False, nproc=None):
     """
     fn: str - filename
+    mmap: bool - memory-map plain files, and yield FastaRecordView objects
+        (offsets into the map) instead of FastaRecord objects. The views
+        are valid only inside the with-block. Ignored for .gz, .dexta and '-'.
+    nproc: int - inflater threads for BGZF .gz files (default: all cores).
+        Plain .gz files are inflated on one background thread.
 
     Note: If you already have a fileobj, you can iterate over yield_fasta_records() directly.
 
@@ -209,8 +660,12 @@ def open_fasta_reader(fn, log=LOG.info):
     """
     filename = abspath(expanduser(fn))
     mode = 'r'
+    if mmap and '-' != fn and not filename.endswith((".gz", ".dexta")):
+        with open_mmap(filename) as mapped:
+            yield yield_mmap_fasta_records(mapped, filename, log=log)
+        return
     if filename.endswith(".gz"):
-        ofs = gzip.open(filename, mode)
+        ofs = gzip_io.open_gzip(filename, nproc)
     elif filename.endswith(".dexta"):
         ofs = stream_stdout("undexta -vkU -w60 -i", filename)
     elif '-' == fn:
@@ -233,3 +688,150 @@ class FastaReader(object):
     def __init__(self, f, log=LOG.info):
         self.filename = f
         self.log = log
+
+
+##
+# FASTA index (.fai), compatible with 'samtools faidx'
+##
+
+FaiEntry = collections.namedtuple('FaiEntry', ['name', 'length', 'offset', 'linebases', 'linewidth'])
+
+
+def fai_entry_from_view(view, fn):
+    """Return the FaiEntry for a FastaRecordView.
+    Raise if the sequence lines do not all have the same width
+    (except the last), since then no index can describe it.
+    """
+    mapped = view._map
+    raw = mapped[view.seq_offset:view.end]
+    length = view.length
+    first_nl = raw.find('\n')
+    if first_nl < 0:
+        # Last record, no trailing newline, single line.
+        return FaiEntry(view.id, length, view.seq_offset, length, length)
+    linewidth = first_nl + 1
+    linebases = first_nl - (1 if raw[first_nl - 1:first_nl] == '\r' else 0)
+    if length and not linebases:
+        # A blank first line cannot describe the rest.
+        raise Exception('Different line length in sequence {!r} of {!r}'.format(
+            view.id, fn))
+    if length:
+        # Every full line must end exactly at a multiple of linewidth.
+        nfull = length // linebases
+        line_ends = raw[linewidth - 1:nfull * linewidth:linewidth]
+        tail = raw[nfull * linewidth:].rstrip('\r\n')
+        if line_ends != '\n' * nfull or len(tail) != length % linebases or '\n' in tail:
+            raise Exception('Different line length in sequence {!r} of {!r}'.format(
+                view.id, fn))
+    return FaiEntry(view.id, length, view.seq_offset, linebases, linewidth)
+
+
+def write_fai(ofs, entries):
+    for entry in entries:
+        ofs.write('{}\t{}\t{}\t{}\t{}\n'.format(*entry))
+
+
+def read_fai(ifs):
+    entries = list()
+    for line in ifs:
+        name, length, offset, linebases, linewidth = line.rstrip('\n').split('\t')[:5]
+        entries.append(FaiEntry(name, int(length), int(offset), int(linebases), int(linewidth)))
+    return entries
+
+
+def build_fasta_index(fn, fai_fn=None, log=LOG.info):
+    """Write a samtools-style .fai for plain FASTA file fn.
+    Return the fai filename.
+    """
+    filename = abspath(expanduser(fn))
+    if not fai_fn:
+        fai_fn = filename + '.fai'
+    with open_mmap(filename) as mapped:
+        entries = [fai_entry_from_view(view, filename)
+                   for view in yield_mmap_fasta_records(mapped, filename, log=log)]
+    tmp_fn = fai_fn + '.tmp'
+    with open(tmp_fn, 'w') as ofs:
+        write_fai(ofs, entries)
+    os.rename(tmp_fn, fai_fn)
+    LOG.info('Indexed {} records of {!r} into {!r}'.format(len(entries), filename, fai_fn))
+    return fai_fn
+
+
+class IndexedFastaReader(object):
+    """Random access into a memory-mapped FASTA file, via its .fai entries.
+    Records may be looked up by id (the header up to the first whitespace)
+    or by ordinal (0-based position in the file).
+
+    Usage:
+        with open_indexed_fasta_reader('subreads.fasta') as reader:
+            record = reader.fetch('m54006/123/0_9000')
+            bases = reader.fetch_sequence(7, 100, 200)
+    """
+    def __init__(self, mapped, entries, fn=None):
+        self._map = mapped
+        self.entries = entries
+        self.fn = fn
+        self.ordinals = dict()
+        for (i, entry) in enumerate(entries):
+            if entry.name in self.ordinals:
+                LOG.warning('Duplicate id {!r} in {!r}. Only the first is indexed by name.'.format(
+                    entry.name, fn))
+                continue
+            self.ordinals[entry.name] = i
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.ordinals
+
+    def entry(self, key):
+        """key: int (ordinal) or str (id)
+        """
+        if isinstance(key, numbers.Integral):
+            return self.entries[key]
+        return self.entries[self.ordinals[key]]
+
+    def _base_offset(self, entry, pos):
+        return entry.offset + (pos // entry.linebases) * entry.linewidth + pos % entry.linebases
+
+    def fetch(self, key):
+        """Return the whole record as a FastaRecordView (including the full header).
+        """
+        entry = self.entry(key)
+        seq_offset = entry.offset
+        header_start = self._map.rfind('\n', 0, seq_offset - 1) + 1
+        if entry.length:
+            newline = self._map.find('\n', self._base_offset(entry, entry.length - 1))
+            end = len(self._map) if newline < 0 else newline + 1
+        else:
+            end = seq_offset
+        return FastaRecordView(self._map, header_start, seq_offset, end)
+
+    def fetch_sequence(self, key, start=0, end=None):
+        """Return bases [start, end) of the record, 0-based, without newlines.
+        """
+        entry = self.entry(key)
+        if end is None or end > entry.length:
+            end = entry.length
+        if start >= end:
+            return ''
+        beg_offset = self._base_offset(entry, start)
+        end_offset = self._base_offset(entry, end - 1) + 1
+        return strip_newlines(self._map[beg_offset:end_offset], entry.linewidth - entry.linebases > 1)
+
+
+@contextlib.contextmanager
+def open_indexed_fasta_reader(fn, fai_fn=None, log=LOG.info):
+    """Yield an IndexedFastaReader for a plain FASTA file.
+    The .fai is (re-)built first if missing or older than the FASTA.
+    """
+    filename = abspath(expanduser(fn))
+    if not fai_fn:
+        fai_fn = filename + '.fai'
+    if not os.path.exists(fai_fn) or os.path.getmtime(fai_fn) < os.path.getmtime(filename):
+        build_fasta_index(filename, fai_fn, log=log)
+    with open(fai_fn) as ifs:
+        entries = read_fai(ifs)
+    with open_mmap(filename) as mapped:
+        yield IndexedFastaReader(mapped, entries, filename)
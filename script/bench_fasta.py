@@ -0,0 +1,128 @@
+#! /usr/bin/env python2.7
+"""Benchmark the FASTA readers in FastaReader on a synthetic file.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import FastaReader
+import io_io
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+LOG = logging.getLogger()
+
+
+def write_synthetic_fasta(fn, nreads, min_len, max_len, columns=None, seed=0):
+    """Write PacBio-like subreads, named 'movie/zmw/start_end'.
+    Wrap at 'columns', or not at all if columns is None.
+    """
+    rng = random.Random(seed)
+    with open(fn, 'w') as ofs:
+        for zmw in range(nreads):
+            rlen = rng.randint(min_len, max_len)
+            # We are timing parsing, not the RNG, so the bases need not be random.
+            start = rng.randint(0, 3)
+            seq = ('ACGT' * (rlen // 4 + 2))[start:start + rlen]
+            ofs.write('>m_bench/{}/0_{}\n'.format(zmw, rlen))
+            if columns:
+                ofs.write(FastaReader.wrap(seq, columns))
+            else:
+                ofs.write(seq)
+            ofs.write('\n')
+
+
+def bench(label, fn, func):
+    """Run func(fn) and report throughput in MB/s of input.
+    """
+    size = io_io.filesize(fn)
+    start = time.time()
+    nreads, nbases = func(fn)
+    elapsed = max(time.time() - start, 1e-9)
+    msg = '{:<24} {:>10,d} reads {:>14,d} bases {:8.2f}s {:10.1f} MB/s'.format(
+        label, nreads, nbases, elapsed, size / 2**20 / elapsed)
+    sys.stdout.write(msg + '\n')
+    return nreads, nbases
+
+
+def open_quiet(fn, mmap):
+    return FastaReader.open_fasta_reader(fn, log=LOG.debug, mmap=mmap)
+
+
+def count_stream(fn):
+    nreads = nbases = 0
+    with open_quiet(fn, mmap=False) as reader:
+        for rec in reader:
+            nreads += 1
+            nbases += len(rec.sequence)
+    return nreads, nbases
+
+
+def count_blocks(fn, blocksize):
+    nreads = nbases = 0
+    with open(fn) as ifs:
+        for rec in FastaReader.yield_fasta_records_from_blocks(ifs, fn, log=LOG.debug, blocksize=blocksize):
+            nreads += 1
+            nbases += len(rec.sequence)
+    return nreads, nbases
+
+
+def count_mmap(fn):
+    nreads = nbases = 0
+    with open_quiet(fn, mmap=True) as reader:
+        for rec in reader:
+            nreads += 1
+            nbases += rec.length
+    return nreads, nbases
+
+
+def run(nreads, min_len, max_len, columns, seed, blocksizes_mb):
+    with io_io.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, 'bench.fasta')
+        write_synthetic_fasta(fn, nreads, min_len, max_len, columns, seed)
+        sys.stdout.write('{}: {}\n'.format(fn, io_io.eng(io_io.filesize(fn))))
+        expected = bench('yield_fasta_records', fn, count_stream)
+        for mb in blocksizes_mb:
+            got = bench('blocks ({}MB)'.format(mb), fn,
+                        lambda fn: count_blocks(fn, mb * 2**20))
+            assert expected == got, '{!r} != {!r}'.format(expected, got)
+        got = bench('mmap (lengths only)', fn, count_mmap)
+        assert expected == got, '{!r} != {!r}'.format(expected, got)
+
+
+class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Compare FASTA parsing throughput on synthetic PacBio subreads.',
+        formatter_class=HelpF,
+    )
+    parser.add_argument('--nreads', type=int, default=2000,
+                        help='Number of synthetic reads.')
+    parser.add_argument('--min-len', type=int, default=10000,
+                        help='Minimum read length.')
+    parser.add_argument('--max-len', type=int, default=100000,
+                        help='Maximum read length.')
+    parser.add_argument('--columns', type=int, default=60,
+                        help='Wrap sequences at this width (0 for unwrapped).')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed.')
+    parser.add_argument('--blocksizes', default='4,16,64',
+                        help='Comma-separated block sizes (MB) for the block parser.')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    blocksizes_mb = [int(mb) for mb in args.blocksizes.split(',')]
+    run(args.nreads, args.min_len, args.max_len, args.columns or None, args.seed, blocksizes_mb)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv)          # pragma: no cover
@@ -3,51 +3,15 @@ import os
 import sys
 
 import io_io
+from io_io import symlink
 import logging
 LOG = logging.getLogger()
 
 import bash
 import functional
-import glob
 import re
+from dazzler_db import DazzlerDB
 
-def get_tracks(db_fn):
-    db_dirname, db_basename = os.path.split(db_fn)
-    dbname = os.path.splitext(db_basename)[0]
-    fns = glob.glob('{}/.{}.*.anno'.format(db_dirname, dbname))
-    re_anno = re.compile(r'\.{}\.([^\.]+)\.anno'.format(dbname))
-    tracks = [re_anno.search(fn).group(1) for fn in fns]
-    return tracks
-
-def symlink(actual, symbolic=None, force=True):
-    """Symlink into cwd, relatively.
-    symbolic name is basename(actual) if not provided.
-    If not force, raise when already exists and does not match.
-    But ignore symlink to self.
-    """
-    symbolic = os.path.basename(actual) if not symbolic else symbolic
-    if os.path.abspath(actual) == os.path.abspath(symbolic):
-        LOG.warning('Cannot symlink {!r} as {!r}, itself.'.format(actual, symbolic))
-        return
-    rel = os.path.relpath(actual)
-    if force:
-        LOG.info('ln -sf {} {}'.format(rel, symbolic))
-        if os.path.lexists(symbolic):
-            if os.readlink(symbolic) == rel:
-                return
-            else:
-                os.unlink(symbolic)
-    else:
-        LOG.info('ln -s {} {}'.format(rel, symbolic))
-        if os.path.lexists(symbolic):
-            if os.readlink(symbolic) != rel:
-                msg = '{!r} already exists as {!r}, not {!r}'.format(
-                        symbolic, os.readlink(symbolic), rel)
-                raise Exception(msg)
-            else:
-                LOG.info('{!r} already points to {!r}'.format(symbolic, rel))
-                return
-    os.symlink(rel, symbolic)
 
 def script_HPC_daligner(daligner_opt, db, length_cutoff_fn, tracks, prefix):
     params = dict()
@@ -65,12 +29,11 @@ HPC.daligner -P. {daligner_opt} {masks} -H$CUTOFF -f{prefix} {db} >| run_jobs.sh
     """.format(**params)
 
 
-
 def daligner_split(daligner_opt, db_fn, length_cutoff_fn):
     db = os.path.splitext(db_fn)[0]
     dbname = os.path.basename(db)
 
-    tracks = get_tracks(db_fn)
+    tracks = DazzlerDB.load(db_fn).tracks
 
     script = ''.join([
         script_HPC_daligner(daligner_opt, db, length_cutoff_fn, tracks, prefix='daligner-jobs'),
@@ -132,8 +95,6 @@ def daligner_split(daligner_opt, db_fn, length_cutoff_fn):
             stream.write(script)
 
 
-
-
 def parse_args(argv):
     parser = argparse.ArgumentParser()
 
@@ -1,15 +1,35 @@
 from __future__ import absolute_import
+from __future__ import division
 
 import argparse
+import collections
+import glob
 import logging
+import multiprocessing.pool
 import os
+import pipes
+import re
+import shutil
+import subprocess
 import sys
+import tempfile
+import time
 from io_io import yield_validated_fns
 import io_io
 import functional
 import bash
+from dazzler_db import DazzlerDB
+from fasta_filter import DIGEST_ENTRY
 LOG = logging.getLogger()
 WAIT = 20 # seconds to wait for file to exist
+GZIP_IO_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gzip_io.py')
+BUILD_DB_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build_db.py')
+DAZZLER_DB_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dazzler_db.py')
+# Rough daligner memory per base of each block it holds (k-mer index plus sort space).
+# Calibrate with /usr/bin/time on one job, if the -M estimates look off.
+DALIGNER_BYTES_PER_BASE = 16
+DALIGNER_BLOCKS_PER_JOB = 4  # HPC.daligner -B default
+DALIGNER_JOB_WAVES = 4  # default target: enough jobs to fill every slot this many times
 
 
 class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
@@ -25,44 +45,287 @@ def filter_DBsplit_option(opt):
     return ' '.join(flags)
 
 
-def script_build_db(input_fofn_fn, db,pa_DBdust_option,fasta_filter_option,fasta_filter_py):
+def script_build_db(input_fofn_fn, db,pa_DBdust_option,fasta_filter_option,fasta_filter_py, nproc=0, min_length=0,
+                    ingest_jobs=0, incremental=False, dust=True, order=None):
     """
     db (e.g. 'raw_reads.db') will be output into CWD, should not already exist.
-    'dust' track will also be generated.
+    'dust' track will also be generated, unless not dust (for per-block jobs, from dust_split()).
+    If nproc, .gz inputs are inflated by gzip_io.py on that many threads, instead of zcat,
+    and plain inputs are given to fasta_filter directly, so it can filter them on nproc processes.
+    If min_length, fasta_filter drops shorter reads before fasta2DB, and writes
+    a histogram of the kept lengths to '<input basename>.lengths.json'.
+    If order ('length' or 'interleave'), fasta_filter reorders the wells of each input
+    by length, so that DBsplit blocks get similar length distributions.
+    If ingest_jobs > 1, the next ingest_jobs inputs are filtered concurrently
+    (see ingest_fofn()); fasta2DB still appends them one at a time, in FOFN order.
+    If incremental, an existing db is kept, and only the inputs not yet in its
+    manifest are appended (see append_new_files()). DBdust extends an existing
+    'dust' track to the new reads only.
+    If fasta_filter_option is dedup, a read is dropped if it duplicates one of any earlier
+    input too, not only of its own: each run extends the digests file of the DB
+    (see digests_fn()), so inputs are filtered one at a time, in FOFN order.
     """
     params = dict()
     if not pa_DBdust_option:
         pa_DBdust_option = ""
     if not fasta_filter_option:
         fasta_filter_option="pass"
+    if 'dedup' in fasta_filter_option.split():
+        fasta_filter_option = '--digests-fn {} {}'.format(digests_fn(db), fasta_filter_option)
+        if ingest_jobs > 1:
+            LOG.warning('Filtering one input at a time, not --ingest-jobs={}, since dedup needs the digests of every earlier input.'.format(
+                ingest_jobs))
+            ingest_jobs = 1
+    if min_length:
+        fasta_filter_option = '--min-length {} --length-histogram ${{fn##*/}}.lengths.json {}'.format(
+            min_length, fasta_filter_option)
+    if order:
+        fasta_filter_option = '--order {} {}'.format(order, fasta_filter_option)
+    # fasta2DB does not care about line-wrapping, so skip it.
+    fasta_filter_option = '--columns 0 {}'.format(fasta_filter_option)
 
     try:
         cat_fasta = functional.choose_cat_fasta(open(input_fofn_fn).read())
     except Exception:
         LOG.exception('Using "cat" by default.')
         cat_fasta = 'cat '
-    DBdust = 'DBdust {} {}'.format(pa_DBdust_option, db)
+    if nproc and cat_fasta == 'zcat ':
+        cat_fasta = 'python {} --nproc {} '.format(GZIP_IO_PY, nproc)
+    if nproc and cat_fasta == 'cat ':
+        filter_fasta = 'python {} --nproc {} {} ${{fn}}'.format(fasta_filter_py, nproc, fasta_filter_option)
+    else:
+        filter_fasta = '{} ${{fn}} | python {} {} -'.format(cat_fasta, fasta_filter_py, fasta_filter_option)
+    if incremental:
+        rm_db = '# incremental: keep {db}.db and .{db}.*, if they match {manifest}'.format(
+            db=db, manifest=manifest_fn(db))
+        ingest = 'python {} append --db {} --jobs {} --filter-fasta {} --timing-fn ingest_timing.json {}'.format(
+            BUILD_DB_PY, db, max(1, ingest_jobs), pipes.quote(filter_fasta), input_fofn_fn)
+    elif ingest_jobs > 1:
+        rm_db = 'rm -f {db}.db .{db}.* # in case of re-run'.format(db=db)
+        ingest = 'python {} ingest --db {} --jobs {} --filter-fasta {} --timing-fn ingest_timing.json {}'.format(
+            BUILD_DB_PY, db, ingest_jobs, pipes.quote(filter_fasta), input_fofn_fn)
+    else:
+        rm_db = 'rm -f {db}.db .{db}.* # in case of re-run'.format(db=db)
+        ingest = 'while read fn; do  {} | fasta2DB -v {} -i${{fn##*/}}; done < {}'.format(
+            filter_fasta, db, input_fofn_fn)
+    if dust:
+        DBdust = 'DBdust {} {}'.format(pa_DBdust_option, db)
+    else:
+        DBdust = '# DBdust runs per block, after DBsplit (build_db.py dust-split)'
     params.update(locals())
     script = """  
 echo "PBFALCON_ERRFILE=$PBFALCON_ERRFILE"
 set -o pipefail
-rm -f {db}.db .{db}.* # in case of re-run
+{rm_db}
 #fc_fasta2fasta < {input_fofn_fn} >| fc.fofn
-while read fn; do  {cat_fasta} ${{fn}} | python {fasta_filter_py} {fasta_filter_option} - | fasta2DB -v {db} -i${{fn##*/}}; done < {input_fofn_fn}
+{ingest}
 #cat fc.fofn | xargs rm -f
 {DBdust}
 """.format(**params)
     return script
 
 
+def filter_one(filter_fasta, fn, out_fn):
+    """Run the filter_fasta pipeline (which refers to ${fn}) on fn, into out_fn.
+    Return elapsed seconds.
+    """
+    start = time.time()
+    cmd = 'set -o pipefail; {} >| {}'.format(filter_fasta, pipes.quote(out_fn))
+    env = dict(os.environ, fn=fn)
+    subprocess.check_call([bash.BASH, '-c', cmd], env=env)
+    return time.time() - start
+
+
+def append_one(db, fn, filtered_fn):
+    """Like '... | fasta2DB -v db -i${fn##*/}', from the filtered file.
+    Return elapsed seconds.
+    """
+    start = time.time()
+    with open(filtered_fn) as stream:
+        subprocess.check_call(['fasta2DB', '-v', db, '-i' + os.path.basename(fn)], stdin=stream)
+    return time.time() - start
+
+
+def ingest_fofn(fns, db, filter_fasta, njobs, tmpdir='.', on_append=None):
+    """Filter the inputs on a pool of njobs, at most njobs files ahead of fasta2DB,
+    which appends them one at a time, in order. So the DB is identical to the one
+    from the serial loop, but decompression and filtering overlap with fasta2DB.
+    Filtered FASTA is staged in a temp-dir under tmpdir, one file per input in flight.
+    on_append(fn) is called after each fasta2DB.
+    Return a list of per-file timings.
+    """
+    timings = list()
+    workdir = tempfile.mkdtemp(prefix='ingest.', dir=tmpdir)
+    pool = multiprocessing.pool.ThreadPool(njobs)
+    try:
+        pending = collections.deque()
+        fns = list(fns)
+        todo = iter(enumerate(fns))
+
+        def submit():
+            item = next(todo, None)
+            if item is not None:
+                i, fn = item
+                filtered_fn = os.path.join(workdir, '{}.fasta'.format(i))
+                result = pool.apply_async(filter_one, (filter_fasta, fn, filtered_fn))
+                pending.append((fn, filtered_fn, result))
+        for _ in range(njobs):
+            submit()
+        while pending:
+            fn, filtered_fn, result = pending.popleft()
+            start = time.time()
+            filter_seconds = result.get()
+            wait_seconds = time.time() - start
+            submit()
+            nbytes = io_io.filesize(filtered_fn)
+            append_seconds = append_one(db, fn, filtered_fn)
+            io_io.rm_force(filtered_fn)
+            if on_append:
+                on_append(fn)
+            timing = dict(fn=fn, filtered_bytes=nbytes, filter_seconds=round(filter_seconds, 3),
+                          wait_seconds=round(wait_seconds, 3), append_seconds=round(append_seconds, 3))
+            LOG.info('Ingested {}/{} {!r}: {} filtered bytes; filter {:.1f}s, waited {:.1f}s, fasta2DB {:.1f}s'.format(
+                len(timings) + 1, len(fns), fn, io_io.eng(nbytes), filter_seconds, wait_seconds, append_seconds))
+            timings.append(timing)
+    finally:
+        pool.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+    LOG.info('Ingested {} files: filter {:.1f}s total, waited {:.1f}s, fasta2DB {:.1f}s'.format(
+        len(timings), sum(t['filter_seconds'] for t in timings),
+        sum(t['wait_seconds'] for t in timings), sum(t['append_seconds'] for t in timings)))
+    return timings
+
+
+def manifest_fn(db):
+    """A hidden file, so 'rm -f .{db}.*' removes it with the DB it describes.
+    """
+    dirname, basename = os.path.split(db)
+    return os.path.join(dirname, '.{}.manifest.json'.format(basename))
+
+
+def digests_fn(db):
+    """The sequence digests of the reads of the DB, one per read, in order
+    (see fasta_filter.py --digests-fn). Hidden, like manifest_fn().
+    """
+    dirname, basename = os.path.split(db)
+    return os.path.join(dirname, '.{}.digests.bin'.format(basename))
+
+
+def truncate_digests(db):
+    """Drop the digests of reads which an interrupted run filtered,
+    but never appended to the DB.
+    """
+    fn = digests_fn(db)
+    if not os.path.exists(fn):
+        return
+    nbytes = DazzlerDB.load(db).nreads * DIGEST_ENTRY.size
+    if io_io.filesize(fn) > nbytes:
+        LOG.info('Truncating {!r} to the {:,d} reads of {!r}'.format(fn, nbytes // DIGEST_ENTRY.size, db))
+        with open(fn, 'r+b') as ofs:
+            ofs.truncate(nbytes)
+
+
+def file_stamp(fn):
+    st = os.stat(fn)
+    return dict(path=os.path.abspath(fn), size=st.st_size, mtime=int(st.st_mtime))
+
+
+def read_manifest(db):
+    """Return dict(files=[file_stamp(), ...] in DB order, blocks=[(ufirst, tfirst), ...] as of the last DBsplit),
+    or None if there is no DB to extend.
+    """
+    db_fn = db + '.db'
+    fn = manifest_fn(db)
+    if not os.path.exists(fn):
+        if os.path.exists(db_fn):
+            LOG.warning('{!r} has no manifest {!r}, so we rebuild it.'.format(db_fn, fn))
+        return None
+    if not os.path.exists(db_fn):
+        LOG.warning('Manifest {!r} has no DB {!r}, so we rebuild it.'.format(fn, db_fn))
+        return None
+    manifest = io_io.deserialize(fn)
+    manifest['blocks'] = [tuple(b) for b in manifest['blocks']]
+    return manifest
+
+
+def new_files(manifest, fns):
+    """Return the fns not yet in the DB.
+    Raise if a file in the DB has changed, since its reads cannot be replaced.
+    """
+    known = dict((f['path'], f) for f in manifest['files'])
+    result = list()
+    for fn in fns:
+        stamp = file_stamp(fn)
+        old = known.pop(stamp['path'], None)
+        if old is None:
+            result.append(fn)
+        elif old != stamp:
+            msg = '{!r} changed since it was added to the DB ({!r} != {!r}). Rebuild without --incremental.'.format(
+                fn, stamp, old)
+            raise Exception(msg)
+    for path in sorted(known):
+        LOG.warning('{!r} is in the DB, but no longer in the FOFN.'.format(path))
+    return result
+
+
+def append_new_files(fns, db, filter_fasta, njobs, tmpdir='.'):
+    """Append to db only the fns which are not in its manifest,
+    or rebuild it from all fns if it has none.
+    The manifest is updated after each fasta2DB, so an interrupted run can resume;
+    the digests file of dedup, if any, is truncated to the reads in the DB.
+    Its 'blocks' are left as they were, for update_new_blocks() after DBsplit.
+    Return the per-file timings.
+    """
+    manifest = read_manifest(db)
+    if manifest is None:
+        dirname, basename = os.path.split(db)
+        io_io.rm_force(db + '.db', *glob.glob(os.path.join(dirname, '.{}.*'.format(basename))))
+        manifest = dict(files=list(), blocks=[(0, 0)])
+        todo = fns
+    else:
+        todo = new_files(manifest, fns)
+        truncate_digests(db)
+    LOG.info('Appending {} of {} files to {!r}'.format(len(todo), len(fns), db))
+    io_io.serialize(manifest_fn(db), manifest)
+
+    def on_append(fn):
+        manifest['files'].append(file_stamp(fn))
+        io_io.serialize(manifest_fn(db), manifest)
+    return ingest_fofn(todo, db, filter_fasta, njobs, tmpdir, on_append=on_append)
+
+
+def update_new_blocks(db):
+    """After DBsplit, return the 1-based ids of the blocks which are new or changed
+    since the split recorded in the manifest, and record the new split.
+    DBsplit fills blocks greedily from the first read, so appending reads
+    changes at most the old last block, and adds blocks after it.
+    """
+    import dazzler
+    manifest = io_io.deserialize(manifest_fn(db))
+    old = [tuple(b) for b in manifest['blocks']]
+    blocks = dazzler.read_db(db)['blocks']
+    new_blocks = [i for i in range(1, len(blocks))
+                  if i >= len(old) or blocks[i - 1:i + 1] != old[i - 1:i + 1]]
+    manifest['blocks'] = blocks
+    io_io.serialize(manifest_fn(db), manifest)
+    return new_blocks
+
+
+def script_new_blocks(db, new_blocks_fn='new_blocks.json'):
+    return """
+python {} new-blocks --db {} --new-blocks-fn {}
+""".format(BUILD_DB_PY, db, new_blocks_fn)
+
+
 def script_length_cutoff( db,seed_coverage,genome_size,length_cutoff,length_cutoff_fn='length_cutoff'):
     params = dict()
 
     if int(length_cutoff) < 0:
         if not seed_coverage or not genome_size:
             LOG.exception("must have values seed_coverage and genome_size if length_cutoff = -1")
-        bash_cutoff = '$(python2.7 -m calc_cutoff --coverage {} {} <(DBstats -b1 {}))'.format(
-            seed_coverage, genome_size, db)
+        # Read the lengths from the .idx, rather than have DBstats walk the whole DB.
+        bash_cutoff = '$(python2.7 -m calc_cutoff --coverage {} --db {} {})'.format(
+            seed_coverage, db, genome_size)
     else:
         bash_cutoff = '{}'.format(length_cutoff)
     params.update(locals())
@@ -72,16 +335,166 @@ echo -n $CUTOFF >| {length_cutoff_fn}
 """.format(**params)
 
 
-def script_DBsplit( db,DBsplit_opt):
+def parse_daligner_opt(daligner_opt):
+    """Return (-M in GB, or 0 for no limit; -B, blocks per HPC.daligner job).
+    >>> parse_daligner_opt('-e.7 -l1000 -k18 -h80 -w8 -s100 -v -B128 -M24')
+    (24, 128)
+    """
+    mem = re.search(r'(?:^|\s)-M(\d+)', daligner_opt or '')
+    per_job = re.search(r'(?:^|\s)-B(\d+)', daligner_opt or '')
+    return (int(mem.group(1)) if mem else 0,
+            int(per_job.group(1)) if per_job else DALIGNER_BLOCKS_PER_JOB)
+
+
+def daligner_job_count(nblocks, blocks_per_job):
+    """HPC.daligner compares block i with blocks 1..i, at most blocks_per_job per job.
+    >>> daligner_job_count(10, 1), daligner_job_count(10, 4)
+    (55, 18)
+    """
+    return sum((i + blocks_per_job - 1) // blocks_per_job for i in range(1, nblocks + 1))
+
+
+def split_keep(db, DBsplit_opt):
+    """Return (lengths, keep) of the reads of an unsplit db,
+    keep being the reads DBsplit would put in the trimmed DB, given DBsplit_opt.
+    """
+    import dazzler
+    header, reads = dazzler.read_idx(dazzler.db_paths(db)[1])
+    cutoff = re.search(r'(?:^|\s)-x(\d+)', DBsplit_opt)
+    header = dict(header, cutoff=int(cutoff.group(1)) if cutoff else 0,
+                  allarr=dazzler.DB_ALL if re.search(r'(?:^|\s)-a\b', DBsplit_opt) else 0)
+    lengths = reads['rlen'].astype('int64')
+    return lengths, dazzler.trimmed_mask(header, reads, lengths)
+
+
+def plan_DBsplit(lengths, keep, slots, target_jobs=0, mem_gb=0, blocks_per_job=DALIGNER_BLOCKS_PER_JOB):
+    """Choose DBsplit -s (in MB of bases) for about target_jobs daligner jobs
+    (by default, DALIGNER_JOB_WAVES per slot), but with blocks small enough
+    that a pair of them fits in mem_gb, if given.
+    Return a dict of the plan, with the exact blocks DBsplit will make.
+    """
+    import dazzler
+    import numpy as np
+    total = int(lengths[keep].sum())
+    target_jobs = target_jobs or DALIGNER_JOB_WAVES * slots
+    nblocks = 1
+    while daligner_job_count(nblocks, blocks_per_job) < target_jobs:
+        nblocks += 1
+    size_mb = max(1, total // nblocks // 1000000)
+    if mem_gb:
+        max_size_mb = mem_gb * 10**9 // (2 * DALIGNER_BYTES_PER_BASE) // 1000000
+        if size_mb > max_size_mb:
+            LOG.info('-s{} would not fit in -M{}; using -s{}.'.format(size_mb, mem_gb, max_size_mb))
+            size_mb = max(1, max_size_mb)
+    boundaries = dazzler.plan_blocks(lengths, keep, size_mb)
+    kept_cum = np.concatenate(([0], np.cumsum(lengths[keep])))
+    block_bases = np.diff(kept_cum[[tfirst for (_, tfirst) in boundaries]])
+    nblocks = len(block_bases)
+    jobs = daligner_job_count(nblocks, blocks_per_job)
+    max_block = int(block_bases.max()) if nblocks else 0
+    return dict(
+        size_mb=size_mb, total_bases=total, nreads=int(keep.sum()),
+        nblocks=nblocks, jobs=jobs, slots=slots, target_jobs=target_jobs,
+        waves=jobs / slots if slots else None,
+        mean_block_bases=int(block_bases.mean()) if nblocks else 0, max_block_bases=max_block,
+        # Each job compares one block against up to blocks_per_job others, a pair at a time.
+        max_bases_per_job=max_block * (1 + min(blocks_per_job, nblocks)),
+        est_mem_gb_per_job=2 * max_block * DALIGNER_BYTES_PER_BASE / 10**9,
+        mem_gb=mem_gb,
+    )
+
+
+def log_DBsplit_plan(plan):
+    LOG.info('DBsplit -s{size_mb}: {nreads} reads, {total_bases} bases in {nblocks} blocks'
+             ' (mean {mean_block_bases}, max {max_block_bases} bases)'.format(**plan))
+    LOG.info('{jobs} daligner jobs (target {target_jobs}) on {slots} slots;'
+             ' up to {max_bases_per_job} bases and ~{est_mem_gb_per_job:.1f}GB per job (-M{mem_gb})'.format(**plan))
+
+
+def script_DBsplit( db,DBsplit_opt, daligner_opt=None, slots=0, target_jobs=0):
+    """If slots, choose -s from the DB (via 'build_db.py plan-split') instead of DBsplit_opt.
+    """
     params = dict()
     params.update(locals())
     DBsplit_opt = filter_DBsplit_option(DBsplit_opt)
+    if slots:
+        DBsplit_opt = re.sub(r'(?:^|\s)-s\d+', '', DBsplit_opt).strip()
+        plan_split = 'python {} plan-split --db {} --DBsplit-opt={} --daligner-opt={} --slots {} --target-jobs {}\n'.format(
+            BUILD_DB_PY, db, pipes.quote(DBsplit_opt), pipes.quote(daligner_opt or ''), slots, target_jobs)
+        DBsplit_opt += ' -s$(cat DBsplit_size)'
+    else:
+        plan_split = ''
     params.update(locals())
     return """
-DBsplit -f {DBsplit_opt} {db}
-LB=$(cat {db}.db | LD_LIBRARY_PATH= awk '$1 == "blocks" {{print $3}}')
-echo -n $LB >| db_block_count
-""".format(**params)
+{plan_split}DBsplit -f {DBsplit_opt} {db}
+python {DAZZLER_DB_PY} nblocks {db} >| db_block_count
+""".format(DAZZLER_DB_PY=DAZZLER_DB_PY, **params)
+
+
+def dust_split(db_fn, DBdust_opt, script_dir='dust-scripts'):
+    """After DBsplit, write a DBdust job per block, as
+    dust-scripts/dust_000/run_DBdust.sh, ...
+    Each job writes the block track .{db}.{block}.dust.* into its own CWD.
+    Return the script filenames.
+    """
+    db_dir, db_basename = os.path.split(os.path.abspath(db_fn))
+    db = os.path.splitext(db_basename)[0]
+    nblocks = DazzlerDB.load(os.path.join(db_dir, db + '.db')).nblocks
+    LOG.info('Writing {} DBdust jobs for {!r}'.format(nblocks, db_fn))
+    script_fns = list()
+    for block in range(1, nblocks + 1):
+        bash_script = """
+db_dir={db_dir}
+ln -sf ${{db_dir}}/.{db}.bps .
+ln -sf ${{db_dir}}/.{db}.idx .
+ln -sf ${{db_dir}}/{db}.db .
+rm -f .{db}.{block}.dust.anno .{db}.{block}.dust.data
+DBdust {DBdust_opt} {db}.{block}
+""".format(db_dir=db_dir, db=db, block=block, DBdust_opt=DBdust_opt)
+        job_id = 'dust_{:03d}'.format(block - 1)
+        job_dir = os.path.join('.', script_dir, job_id)
+        script_fn = os.path.join(job_dir, 'run_DBdust.sh')
+        io_io.mkdirs(job_dir)
+        with open(script_fn, 'w') as stream:
+            stream.write('{}\n'.format(bash_script))
+        script_fns.append(script_fn)
+    return script_fns
+
+
+def read_gathered(gathered_fn):
+    """Return the filenames of a JSON list, or of a list as Nextflow prints it: '[a, b, c]'.
+    """
+    text = open(gathered_fn).read().strip()
+    return [fn.strip().strip('"\'') for fn in text.strip('[]').split(',') if fn.strip()]
+
+
+def dust_combine(db_fn, gathered_fn):
+    """Symlink the DB and the per-block dust tracks (from the dirs of the gathered
+    job-done files) into CWD, and concatenate them into the 'dust' track of the DB.
+    """
+    db_dir, db_basename = os.path.split(os.path.abspath(db_fn))
+    db = os.path.splitext(db_basename)[0]
+    lines = [
+        'rm -f .{db}.dust.anno .{db}.dust.data'.format(db=db),
+    ]
+    for fn in (db + '.db', '.{}.idx'.format(db), '.{}.bps'.format(db)):
+        lines.append('ln -sf {} .'.format(os.path.join(db_dir, fn)))
+    nblocks = 0
+    for done_fn in read_gathered(gathered_fn):
+        job_dir = os.path.dirname(os.path.abspath(done_fn))
+        annos = glob.glob('{}/.{}.*.dust.anno'.format(job_dir, db))
+        datas = glob.glob('{}/.{}.*.dust.data'.format(job_dir, db))
+        assert len(annos) == len(datas), 'Mismatched globs:\n{!r}\n{!r}'.format(annos, datas)
+        nblocks += len(annos)
+        for fn in sorted(annos + datas):
+            lines.append('ln -sf {} .'.format(fn))
+    LOG.info('Combining {} block dust tracks of {!r}'.format(nblocks, db))
+    # -d removes the block tracks (here, only the symlinks).
+    lines.append('Catrack -vdf {} dust'.format(db))
+    script_fn = 'dust_combine.sh'
+    with open(script_fn, 'w') as ofs:
+        bash.write_sub_script(ofs, '\n'.join(lines) + '\n')
+    io_io.syscall('bash -vex {}'.format(script_fn))
 
 
 def cmd_build(args):
@@ -96,8 +509,10 @@ def cmd_build(args):
             stream.write(fn)
             stream.write('\n')
     script = ''.join([
-        script_build_db(my_input_fofn_fn, db,args.pa_DBdust_option,args.fasta_filter_option,args.fasta_filter_py),
-        script_DBsplit(db, args.DBsplit_opt),
+        script_build_db(my_input_fofn_fn, db,args.pa_DBdust_option,args.fasta_filter_option,args.fasta_filter_py, args.nproc,
+                        args.min_length, args.ingest_jobs, args.incremental, not args.split_dust, args.order),
+        script_DBsplit(db, args.DBsplit_opt, args.daligner_opt, args.slots, args.target_jobs),
+        script_new_blocks(db) if args.incremental else '',
         script_length_cutoff(db, args.seed_coverage,args.genome_size,args.length_cutoff,args.length_cutoff_fn),
     ])
     script_fn = 'build_db.sh'
@@ -105,6 +520,43 @@ def cmd_build(args):
         bash.write_sub_script(ofs, script)
 
 
+def cmd_ingest(args):
+    fns = [line.strip() for line in open(args.fofn) if line.strip()]
+    timings = ingest_fofn(fns, args.db, args.filter_fasta, args.jobs, args.tmpdir)
+    if args.timing_fn:
+        io_io.serialize(args.timing_fn, timings)
+
+
+def cmd_append(args):
+    fns = [line.strip() for line in open(args.fofn) if line.strip()]
+    timings = append_new_files(fns, args.db, args.filter_fasta, args.jobs, args.tmpdir)
+    if args.timing_fn:
+        io_io.serialize(args.timing_fn, timings)
+
+
+def cmd_new_blocks(args):
+    new_blocks = update_new_blocks(args.db)
+    LOG.info('New or changed blocks of {!r}: {!r}'.format(args.db, new_blocks))
+    io_io.serialize(args.new_blocks_fn, new_blocks)
+
+
+def cmd_dust_split(args):
+    dust_split(args.db_fn, args.DBdust_opt, args.script_dir)
+
+
+def cmd_dust_combine(args):
+    dust_combine(args.db_fn, args.gather_fn)
+
+
+def cmd_plan_split(args):
+    mem_gb, blocks_per_job = parse_daligner_opt(args.daligner_opt)
+    lengths, keep = split_keep(args.db, args.DBsplit_opt)
+    plan = plan_DBsplit(lengths, keep, args.slots, args.target_jobs, mem_gb, blocks_per_job)
+    log_DBsplit_plan(plan)
+    io_io.serialize(args.report_fn, plan)
+    with open(args.size_fn, 'w') as stream:
+        stream.write('{}'.format(plan['size_mb']))
+
 
 def add_build_arguments(parser):
     parser.add_argument(
@@ -182,7 +634,45 @@ def parse_args(argv):
     )
     parser.add_argument(
         '--nproc', type=int, default=0,
-        help='ignored for now, but non-zero will mean "No more than this."',
+        help='Threads for inflating .gz inputs (via gzip_io.py instead of zcat), and processes for fasta_filter on plain inputs. 0 means zcat/cat into a serial fasta_filter.',
+    )
+
+    parser.add_argument(
+        '--min-length', type=int, default=0,
+        help='Drop reads shorter than this in fasta_filter, before fasta2DB and DBdust. Off by default: reads below length_cutoff are still used as B-reads, so only set this to the shortest read you want aligned at all (e.g. the DBsplit -x value).',
+    )
+
+    parser.add_argument(
+        '--ingest-jobs', type=int, default=0,
+        help='Filter this many input files concurrently, ahead of fasta2DB (which still appends them serially, in FOFN order). 0 or 1 means the serial loop. Each job also uses --nproc.',
+    )
+
+    parser.add_argument(
+        '--order', choices=('length', 'interleave'),
+        help='Reorder the wells of each input by length in fasta_filter (see fasta_filter.py --order); "interleave" gives every DB block a similar length distribution, to even out daligner jobs. Default: input order.',
+    )
+
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Keep an existing DB, and append only the inputs not already in it (by path, size and mtime, as recorded in .<db>.manifest.json). Write the ids of the new or changed blocks to new_blocks.json.',
+    )
+
+    parser.add_argument(
+        '--split-dust', action='store_true',
+        help='Skip DBdust in "build"; run it per block instead, via "dust-split" and "dust-combine".',
+    )
+
+    parser.add_argument(
+        '--slots', type=int, default=0,
+        help='If set, choose DBsplit -s for the DB (see "plan-split"), ignoring any -s in --DBsplit-opt.',
+    )
+    parser.add_argument(
+        '--target-jobs', type=int, default=0,
+        help='daligner jobs wanted, for --slots. 0 means {} per slot.'.format(DALIGNER_JOB_WAVES),
+    )
+    parser.add_argument(
+        '--daligner-opt', default='',
+        help='daligner options, for --slots: -M limits the block size, -B is blocks per job.',
     )
 
     parser.add_argument(
@@ -200,6 +690,96 @@ def parse_args(argv):
                                          help=help_build)
     add_build_arguments(parser_build)
     parser_build.set_defaults(func=cmd_build)
+
+    help_ingest = 'filter the FOFN inputs concurrently and append them to the DB with fasta2DB, in order'
+    parser_ingest = subparsers.add_parser('ingest',
+                                          formatter_class=HelpF,
+                                          description=help_ingest,
+                                          help=help_ingest)
+    parser_ingest.add_argument('--db', required=True,
+            help='Dazzler DB to append to, e.g. raw_reads')
+    parser_ingest.add_argument('--filter-fasta', required=True,
+            help='bash pipeline which writes the filtered FASTA of ${fn} to stdout')
+    parser_ingest.add_argument('--jobs', type=int, default=2,
+            help='Inputs filtered concurrently (and staged on disk) ahead of fasta2DB.')
+    parser_ingest.add_argument('--tmpdir', default='.',
+            help='Where to stage the filtered FASTA.')
+    parser_ingest.add_argument('--timing-fn', default='',
+            help='If set, write the per-file timings here, as JSON.')
+    parser_ingest.add_argument('fofn',
+            help='File of input FASTA filenames.')
+    parser_ingest.set_defaults(func=cmd_ingest)
+
+    help_append = 'like ingest, but only for the inputs not already in the DB manifest'
+    parser_append = subparsers.add_parser('append',
+                                          formatter_class=HelpF,
+                                          description=help_append,
+                                          help=help_append)
+    parser_append.add_argument('--db', required=True,
+            help='Dazzler DB to append to (or rebuild, if it has no manifest), e.g. raw_reads')
+    parser_append.add_argument('--filter-fasta', required=True,
+            help='bash pipeline which writes the filtered FASTA of ${fn} to stdout')
+    parser_append.add_argument('--jobs', type=int, default=1,
+            help='Inputs filtered concurrently (and staged on disk) ahead of fasta2DB.')
+    parser_append.add_argument('--tmpdir', default='.',
+            help='Where to stage the filtered FASTA.')
+    parser_append.add_argument('--timing-fn', default='',
+            help='If set, write the per-file timings here, as JSON.')
+    parser_append.add_argument('fofn',
+            help='File of input FASTA filenames.')
+    parser_append.set_defaults(func=cmd_append)
+
+    help_new_blocks = 'after DBsplit, list the blocks which are new or changed since the last split'
+    parser_new_blocks = subparsers.add_parser('new-blocks',
+                                              formatter_class=HelpF,
+                                              description=help_new_blocks,
+                                              help=help_new_blocks)
+    parser_new_blocks.add_argument('--db', required=True,
+            help='Dazzler DB, with a manifest from "append"')
+    parser_new_blocks.add_argument('--new-blocks-fn', default='new_blocks.json',
+            help='output. JSON list of 1-based block ids')
+    parser_new_blocks.set_defaults(func=cmd_new_blocks)
+
+    help_dust_split = 'after DBsplit, write a DBdust job per block, into dust-scripts/dust_###/run_DBdust.sh'
+    parser_dust_split = subparsers.add_parser('dust-split',
+                                              formatter_class=HelpF,
+                                              description=help_dust_split,
+                                              help=help_dust_split)
+    parser_dust_split.add_argument('--DBdust-opt', default='',
+            help='DBdust options, e.g. pa_DBdust_option')
+    parser_dust_split.add_argument('--script-dir', default='dust-scripts',
+            help='output. Directory of per-block job dirs.')
+    parser_dust_split.set_defaults(func=cmd_dust_split)
+
+    help_plan_split = 'choose DBsplit -s for the number of slots, a target number of daligner jobs, and daligner -M'
+    parser_plan_split = subparsers.add_parser('plan-split',
+                                              formatter_class=HelpF,
+                                              description=help_plan_split,
+                                              help=help_plan_split)
+    parser_plan_split.add_argument('--db', required=True,
+            help='Dazzler DB, before DBsplit, e.g. raw_reads')
+    parser_plan_split.add_argument('--DBsplit-opt', default='-x70',
+            help='Other DBsplit options; -x and -a decide which reads count.')
+    parser_plan_split.add_argument('--daligner-opt', default='',
+            help='daligner/HPC.daligner options: -M limits the block size, -B is blocks per job.')
+    parser_plan_split.add_argument('--slots', type=int, required=True,
+            help='Concurrent daligner jobs the cluster can run.')
+    parser_plan_split.add_argument('--target-jobs', type=int, default=0,
+            help='daligner jobs wanted. 0 means {} per slot.'.format(DALIGNER_JOB_WAVES))
+    parser_plan_split.add_argument('--size-fn', default='DBsplit_size',
+            help='output. The chosen -s.')
+    parser_plan_split.add_argument('--report-fn', default='DBsplit_plan.json',
+            help='output. The plan: blocks, jobs, and load per job.')
+    parser_plan_split.set_defaults(func=cmd_plan_split)
+
+    help_dust_combine = 'concatenate the per-block dust tracks into the dust track of the DB, via Catrack'
+    parser_dust_combine = subparsers.add_parser('dust-combine',
+                                                formatter_class=HelpF,
+                                                description=help_dust_combine,
+                                                help=help_dust_combine)
+    parser_dust_combine.add_argument('--gather-fn', required=True,
+            help='input. List of the done-files of the DBdust jobs, one per job dir (JSON, or as Nextflow prints a list).')
+    parser_dust_combine.set_defaults(func=cmd_dust_combine)
     args = parser.parse_args(argv[1:])
     return args
 
@@ -207,6 +787,7 @@ def parse_args(argv):
 def main(argv=sys.argv):
     args = parse_args(argv)
     print(args.log_level)
+    logging.basicConfig(level=args.log_level)
     args.func(args)
 
 
@@ -1,13 +1,13 @@
 from __future__ import absolute_import
 
 import argparse
-import glob
 import logging
 import os
 import sys
 import re
 import io_io
 import bash
+from dazzler_db import DazzlerDB
 LOG = logging.getLogger()
 WAIT = 20
 
@@ -15,66 +15,6 @@ WAIT = 20
 class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
     pass
 
-def symlink(actual, symbolic=None, force=True):
-    """Symlink into cwd, relatively.
-    symbolic name is basename(actual) if not provided.
-    If not force, raise when already exists and does not match.
-    But ignore symlink to self.
-    """
-    symbolic = os.path.basename(actual) if not symbolic else symbolic
-    if os.path.abspath(actual) == os.path.abspath(symbolic):
-        LOG.warning('Cannot symlink {!r} as {!r}, itself.'.format(actual, symbolic))
-        return
-    rel = os.path.relpath(actual)
-    if force:
-        LOG.info('ln -sf {} {}'.format(rel, symbolic))
-        if os.path.lexists(symbolic):
-            if os.readlink(symbolic) == rel:
-                return
-            else:
-                os.unlink(symbolic)
-    else:
-        LOG.info('ln -s {} {}'.format(rel, symbolic))
-        if os.path.lexists(symbolic):
-            if os.readlink(symbolic) != rel:
-                msg = '{!r} already exists as {!r}, not {!r}'.format(
-                        symbolic, os.readlink(symbolic), rel)
-                raise Exception(msg)
-            else:
-                LOG.info('{!r} already points to {!r}'.format(symbolic, rel))
-                return
-    os.symlink(rel, symbolic)
-
-def symlink_db(db_fn):
-    """Symlink everything that could be related to this Dazzler DB.
-    Exact matches will probably cause an exception in symlink().
-    """
-    db_dirname, db_basename = os.path.split(db_fn)
-    dbname = os.path.splitext(db_basename)[0]
-
-    fn = os.path.join(db_dirname, dbname + '.db')
-    symlink(fn)
-
-    re_suffix = re.compile(r'^\.%s(\.idx|\.bps|\.dust\.data|\.dust\.anno|\.tan\.data|\.tan\.anno|\.rep\d+\.data|\.rep\d+\.anno)$'%dbname)
-    all_basenames = os.listdir(db_dirname)
-    for basename in sorted(all_basenames):
-        mo = re_suffix.search(basename)
-        if not mo:
-            continue
-        fn = os.path.join(db_dirname, basename)
-        if os.path.exists(fn):
-            symlink(fn)
-        else:
-            LOG.warning('Symlink {!r} seems to be broken.'.format(fn))
-    return dbname
-
-def get_tracks(db_fn):
-    db_dirname, db_basename = os.path.split(db_fn)
-    dbname = os.path.splitext(db_basename)[0]
-    fns = glob.glob('{}/.{}.*.anno'.format(db_dirname, dbname))
-    re_anno = re.compile(r'\.{}\.([^\.]+)\.anno'.format(dbname))
-    tracks = [re_anno.search(fn).group(1) for fn in fns]
-    return tracks
 
 def script_HPC_REPmask(REPmask_opt, db, tracks, prefix, group_size, coverage_limit):
     if group_size == 0: # TODO: Make this a no-op.
@@ -146,7 +86,7 @@ def fake_rep_as_daligner_script_unmoved(script, dbname):
 def _get_rep_daligner_split_scripts(REPmask_opt, db_fn, group_size, coverage_limit):
     db = os.path.splitext(db_fn)[0]
     dbname = os.path.basename(db)
-    tracks = get_tracks(db_fn)
+    tracks = DazzlerDB.load(db_fn).tracks
 
     # First, run HPC.REPmask immediately.
     script = ''.join([
@@ -188,7 +128,6 @@ def rep_daligner_split(REPmask_opt, db_fn,  group_size, coverage_limit):
     """
 
 
-
     scripts = _get_rep_daligner_split_scripts(REPmask_opt, db_fn, group_size, coverage_limit)
 
     for i, script in enumerate(scripts):
@@ -221,7 +160,6 @@ def add_rep_daligner_split_arguments(parser):
     )
 
 
-
 options_note = """
 
 For raw_reads.db, we also look for the following config keys:
@@ -267,12 +205,10 @@ def parse_args(argv):
     subparsers = parser.add_subparsers(help='sub-command help')
 
 
-
-
     parser_rep_daligner_split = subparsers.add_parser('rep-daligner-split',
                                                       formatter_class=HelpF,
                                                       description=help_rep_daligner_split,
-                                                      epilog='HPC.REPmask will be passed mask flags for any mask tracks which we glob.',
+                                                      epilog='HPC.REPmask will be passed mask flags for any mask tracks of the DB.',
                                                       help=help_rep_daligner_split)
     add_rep_daligner_split_arguments(parser_rep_daligner_split)
     parser_rep_daligner_split.set_defaults(func=cmd_rep_daligner_split)
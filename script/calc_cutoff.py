@@ -2,12 +2,57 @@ from __future__ import absolute_import
 
 
 import functional as f
+import io_io
 import argparse
 import os
 import sys
 import traceback
 
 
+def read_histogram(args):
+    from length_histogram import LengthHistogram
+    if args.db:
+        return LengthHistogram.from_idx(args.db)
+    if args.histogram:
+        return LengthHistogram.from_json(args.histogram)
+    capture = open(args.capture) if args.capture != '-' else sys.stdin
+    return LengthHistogram.from_DBstats(capture)
+
+
+def provisional_range(args, hist, target):
+    """For an estimate from sample_fasta.py, return the cutoffs at the ends of
+    its confidence interval for total bases (None if that end has too few bases),
+    else None.
+    """
+    estimate = io_io.deserialize(args.histogram)
+    if not estimate.get('estimated'):
+        return None
+    result = list()
+    for nbases in estimate['nbases_ci']:
+        # The histogram scaled to nbases has the cutoff of the scaled-down target.
+        scaled = target * hist.total_bases / nbases if nbases else float('inf')
+        result.append(hist.cutoff(scaled) if scaled <= hist.total_bases else None)
+    return result
+
+
+def sweep(args):
+    """Parse the stats once, then answer every coverage from the prefix sums.
+    """
+    hist = read_histogram(args)
+    if args.sweep == 'all':
+        rows = hist.curve(args.genome_size)
+    else:
+        coverages = [float(cov) for cov in args.sweep.split(',')]
+        rows = hist.sweep(args.genome_size, coverages)
+    io_io.write_as_json(sys.stdout, dict(
+        genome_size=args.genome_size,
+        total_bases=hist.total_bases,
+        nreads=hist.nreads,
+        rows=rows,
+    ))
+    sys.stdout.write('\n')
+
+
 def main(argv=sys.argv):
     import argparse
 
@@ -15,6 +60,10 @@ def main(argv=sys.argv):
 Given the result of 'DBstats -u -b1' on stdin,
 print the lowest read-length required for sufficient coverage of the genome
 (i.e. 'length_cutoff').
+With --db, read the read-lengths straight from the Dazzler .idx instead.
+With --histogram, read a JSON histogram from 'fasta_filter.py --length-histogram',
+or a provisional estimate from sample_fasta.py (before the DB exists).
+With --sweep, print a JSON table of cutoffs for many coverages at once.
 """
     epilog = """
 This is useful when length_cutoff is not provided but the genome-size
@@ -31,15 +80,34 @@ we will write errors there in addition to stderr.
                         help='Desired coverage ratio (i.e. over-sampling)')
     parser.add_argument('genome_size', type=int,
                         help='Estimated number of bases in genome. (haploid?)')
-    parser.add_argument('capture',  # default='-', # I guess default is not allowed for required args.
-                        help='File with captured output of DBstats. (Otherwise, stdin.)')
+    parser.add_argument('capture', nargs='?', default='-',
+                        help='File with captured output of DBstats. (Otherwise, stdin.) Ignored with --db or --histogram.')
+    parser.add_argument('--db',
+                        help='Dazzler DB (e.g. raw_reads.db). Read lengths from its .idx, instead of DBstats output.')
+    parser.add_argument('--histogram',
+                        help='JSON read-length histogram, from fasta_filter.py --length-histogram or sample_fasta.py, instead of DBstats output. For an estimate, the cutoffs at the ends of its confidence interval go to stderr.')
+    parser.add_argument('--sweep', metavar='COVERAGES',
+                        help='Comma-separated coverages (e.g. "10,20,30,40"), or "all" for the full coverage-vs-cutoff curve. Print a JSON table instead of one cutoff; --coverage is ignored.')
     args = parser.parse_args(argv[1:])
 
+    if args.sweep:
+        sweep(args)
+        return
+
     target = int(args.genome_size * args.coverage)
-    capture = open(args.capture) if args.capture != '-' else sys.stdin
-    stats = capture.read()
     try:
-        cutoff = f.calc_cutoff(target, stats)
+        if args.db:
+            cutoff = read_histogram(args).cutoff(target)
+        elif args.histogram:
+            hist = read_histogram(args)
+            cutoff = hist.cutoff(target)
+            bounds = provisional_range(args, hist, target)
+            if bounds:
+                sys.stderr.write('Provisional length_cutoff {}, from an estimate; {} to {} at the 95% bounds of total bases.\n'.format(
+                    cutoff, bounds[0], bounds[1]))
+        else:
+            capture = open(args.capture) if args.capture != '-' else sys.stdin
+            cutoff = f.calc_cutoff(target, capture)
     except Exception:
         msg = traceback.format_exc()
         msg += 'User-provided genome_size: {}\nDesired coverage: {}\n'.format(
@@ -0,0 +1,210 @@
+#! /usr/bin/env python2.7
+"""Read Dazzler DB metadata directly, without DBstats/DBdump.
+
+A DB 'raw_reads.db' is a small text file (input files, then block
+boundaries from DBsplit), plus hidden files, of which we need only
+'.raw_reads.idx': a DAZZ_DB header followed by one fixed-size DAZZ_READ
+per read. We memory-map the read records, so read-lengths come out as
+NumPy arrays in a fraction of a second, even for 100x human.
+
+The .db stanza itself is parsed in dazzler_db.py (no NumPy), which
+also caches it, with the tracks and file sizes, for every stage.
+
+write_db() writes a small DB (.db and .idx only) for local testing.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+
+from dazzler_db import db_paths, read_db
+
+LOG = logging.getLogger()
+
+# From DB.h (64-bit). DAZZ_READ is 40 bytes, with 2 pads for int64 alignment.
+DAZZ_READ = np.dtype([
+    ('origin', '<i4'), ('rlen', '<i4'), ('fpulse', '<i4'), ('pad0', '<i4'),
+    ('boff', '<i8'), ('coff', '<i8'), ('flags', '<i4'), ('pad1', '<i4'),
+])
+# ureads, treads, cutoff, allarr, freq[4], maxlen, totlen,
+# nreads, trimmed, part, ufirst, tfirst, path, loaded, bases, reads, tracks
+DAZZ_DB_HEADER = struct.Struct('<iiii4fi4xqiiiii4xQi4xQQQ')
+DB_ALL = 0x1  # DAZZ_DB.allarr: all wells are in the trimmed DB
+DB_BEST = 0x0800  # DAZZ_READ.flags: the "best" subread of a well
+
+
+def read_idx(fn):
+    """Return (header fields, DAZZ_READ array) of a Dazzler .idx file.
+    The header size depends on the Dazzler version and pointer size,
+    so infer it from ureads (the first int) and the file size.
+    The array is memory-mapped, so fields are read only as needed.
+    """
+    size = os.path.getsize(fn)
+    ureads, treads, cutoff, allarr = np.fromfile(fn, dtype='<i4', count=4)
+    header_size = size - int(ureads) * DAZZ_READ.itemsize
+    if header_size < 16:
+        raise Exception('Unexpected size {} for .idx {!r} with {} reads'.format(size, fn, ureads))
+    if ureads:
+        reads = np.memmap(fn, dtype=DAZZ_READ, mode='r', offset=header_size, shape=(int(ureads),))
+    else:
+        reads = np.zeros(0, dtype=DAZZ_READ)
+    header = dict(ureads=int(ureads), treads=int(treads), cutoff=int(cutoff), allarr=int(allarr))
+    return header, reads
+
+
+def trimmed_mask(header, reads, rlen=None):
+    """True for the reads in the trimmed DB, as DBstats/daligner see it:
+    at least the DBsplit -x cutoff, and only the best read per well unless -a.
+    rlen: reads['rlen'], if already in memory
+    """
+    if rlen is None:
+        rlen = reads['rlen']
+    keep = np.ones(len(reads), dtype=bool)
+    if header['cutoff'] >= 0:
+        keep &= rlen >= header['cutoff']
+        if not (header['allarr'] & DB_ALL):
+            keep &= (reads['flags'] & DB_BEST) != 0
+    return keep
+
+
+def read_lengths(db_fn, trimmed=True):
+    """Return the read-lengths of a DB (or of its .idx) as an int32 array.
+    """
+    idx_fn = db_fn if db_fn.endswith('.idx') else db_paths(db_fn)[1]
+    header, reads = read_idx(idx_fn)
+    # One strided pass over the map, into a compact array.
+    rlen = np.array(reads['rlen'])
+    if not trimmed:
+        return rlen
+    return rlen[trimmed_mask(header, reads, rlen)]
+
+
+def nblocks(db_fn):
+    """Same as functional.dazzler_get_nblocks(), from the .db file.
+    (Stages should prefer dazzler_db.DazzlerDB.load(db_fn).nblocks, which is cached.)
+    """
+    return max(1, len(read_db(db_fn)['blocks']) - 1)
+
+
+def plan_blocks(lengths, keep, size_mb):
+    """Return the (ufirst, tfirst) block boundaries DBsplit -s would choose.
+    A block ends at the first kept read which brings it to size_mb (in 10^6 bases),
+    so this takes one binary search per block. As in DBsplit, the boundary is
+    just past that read, and the last block is written only if non-empty.
+
+    >>> plan_blocks([6, 1, 1, 6, 1], [True, False, True, True, False], 10 ** -6 * 6)
+    [(0, 0), (1, 1), (4, 3)]
+    >>> plan_blocks([6, 1, 2], [True, True, True], 10 ** -6 * 6)
+    [(0, 0), (1, 1), (3, 3)]
+    """
+    size = size_mb * 1000000
+    lengths = np.asarray(lengths, dtype=np.int64)
+    kept = np.flatnonzero(np.asarray(keep, dtype=bool))
+    cum = np.cumsum(lengths[kept])
+    boundaries = [(0, 0)]
+    t = 0  # kept reads in earlier blocks
+    while t < len(kept):
+        base = cum[t - 1] if t else 0
+        last = int(np.searchsorted(cum, base + size, side='left')) if size > 0 else len(kept)
+        if last >= len(kept):
+            # The rest is smaller than size_mb.
+            boundaries.append((len(lengths), len(kept)))
+            break
+        t = last + 1
+        boundaries.append((int(kept[last]) + 1, t))
+    return boundaries
+
+
+def write_db(db_fn, lengths, size_mb=200, cutoff=0, all_wells=True, fname='fixture', prolog='m000000_fixture'):
+    """Write a DB of reads with the given lengths, already 'DBsplit',
+    as raw_reads.db and .raw_reads.idx only (no bases).
+    Every read is its own well, so every read is 'best'.
+    fname and prolog differ, so a swap of the two is visible.
+    """
+    db_fn, idx_fn = db_paths(db_fn)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    reads = np.zeros(len(lengths), dtype=DAZZ_READ)
+    reads['origin'] = np.arange(len(lengths))
+    reads['rlen'] = lengths
+    reads['boff'] = np.concatenate(([0], np.cumsum((lengths + 3) // 4)[:-1])) if len(lengths) else 0
+    reads['flags'] = DB_BEST
+    keep = lengths >= cutoff
+    blocks = plan_blocks(lengths.tolist(), keep.tolist(), size_mb)
+    allarr = DB_ALL if all_wells else 0
+    header = DAZZ_DB_HEADER.pack(
+        len(lengths), int(keep.sum()), cutoff, allarr, 0.25, 0.25, 0.25, 0.25,
+        int(lengths.max()) if len(lengths) else 0, int(lengths.sum()),
+        len(lengths), 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    with open(idx_fn, 'wb') as ofs:
+        ofs.write(header)
+        ofs.write(reads.tobytes())
+    with open(db_fn, 'w') as ofs:
+        ofs.write('files = {:9d}\n'.format(1))
+        ofs.write('  {:9d} {} {}\n'.format(len(lengths), fname, prolog))
+        ofs.write('blocks = {:9d}\n'.format(len(blocks) - 1))
+        ofs.write('size = {:11d} cutoff = {:9d} all = {:1d}\n'.format(size_mb * 1000000, cutoff, int(all_wells)))
+        for ufirst, tfirst in blocks:
+            ofs.write(' {:9d} {:9d}\n'.format(ufirst, tfirst))
+
+
+def cmd_stats(args):
+    from length_histogram import LengthHistogram
+    hist = LengthHistogram.from_lengths(read_lengths(args.db, trimmed=not args.untrimmed))
+    db = read_db(args.db)
+    sys.stdout.write('reads: {}\nbases: {}\nN50: {}\nblocks: {}\n'.format(
+        hist.nreads, hist.total_bases, hist.n50(), len(db['blocks']) - 1))
+
+
+def cmd_fixture(args):
+    rng = np.random.RandomState(args.seed)
+    lengths = rng.lognormal(np.log(args.mean_len), 0.5, args.nreads).astype(np.int64) + 1
+    write_db(args.db, lengths, size_mb=args.size_mb, cutoff=args.cutoff)
+
+
+class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Read Dazzler DB metadata from the .db and .idx files.',
+        formatter_class=HelpF,
+    )
+    subparsers = parser.add_subparsers(help='sub-command help')
+
+    parser_stats = subparsers.add_parser('stats', formatter_class=HelpF,
+            help='Print #reads, #bases, N50 and #blocks.')
+    parser_stats.add_argument('--untrimmed', action='store_true',
+            help='Include reads not in the trimmed DB.')
+    parser_stats.add_argument('db', help='Dazzler DB, e.g. raw_reads.db')
+    parser_stats.set_defaults(func=cmd_stats)
+
+    parser_fixture = subparsers.add_parser('fixture', formatter_class=HelpF,
+            help='Write a DB (.db and .idx only) of random read-lengths, for testing.')
+    parser_fixture.add_argument('--nreads', type=int, default=10000)
+    parser_fixture.add_argument('--mean-len', type=int, default=10000)
+    parser_fixture.add_argument('--size-mb', type=int, default=200,
+            help='Block size, as DBsplit -s.')
+    parser_fixture.add_argument('--cutoff', type=int, default=0,
+            help='Minimum read-length, as DBsplit -x.')
+    parser_fixture.add_argument('--seed', type=int, default=0)
+    parser_fixture.add_argument('db', help='Output Dazzler DB, e.g. raw_reads.db')
+    parser_fixture.set_defaults(func=cmd_fixture)
+
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    args.func(args)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv)          # pragma: no cover
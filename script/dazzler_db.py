@@ -0,0 +1,291 @@
+#! /usr/bin/env python2.7
+"""Dazzler DB metadata, read once and shared by every stage.
+
+Each stage used to re-read 'raw_reads.db' and re-list its directory
+(for tracks, for symlinks, for the block count). With thousands of jobs
+on a shared filesystem, that is a storm of directory scans.
+
+DazzlerDB parses the .db stanza and lists the directory once, and caches
+the result as a JSON sidecar '.raw_reads.meta.json' beside the DB:
+input files, blocks (read ranges), tracks and file sizes. Later stages
+load the sidecar, which costs only a stat of the .db and of its directory,
+to see whether anything was added, removed or re-split since.
+
+No NumPy here, so even the small scripts can use this.
+"""
+from __future__ import absolute_import
+
+import argparse
+import logging
+import os
+import re
+import sys
+
+import io_io
+
+LOG = logging.getLogger()
+
+META_VERSION = 1
+# Hidden files which a stage needs beside its DB (as symlink_db() used to choose).
+re_linked = re.compile(r'^(idx|bps|dust\.data|dust\.anno|tan\.data|tan\.anno|rep\d+\.data|rep\d+\.anno)$')
+# 'dust.anno' is a track of the DB; '3.dust.anno' is a track of block 3 only.
+re_anno = re.compile(r'^(?:(\d+)\.)?([^\.]+)\.anno$')
+
+
+def db_paths(db_fn):
+    """Return ('raw_reads.db', '.raw_reads.idx') for 'raw_reads' or 'raw_reads.db', in any dir.
+    """
+    if db_fn.endswith('.db'):
+        db_fn = db_fn[:-3]
+    dirname, basename = os.path.split(db_fn)
+    return db_fn + '.db', os.path.join(dirname, '.{}.idx'.format(basename))
+
+
+def read_db(db_fn):
+    """Parse the .db stanza.
+    Return dict(files=[(last ureads, fname, prolog), ...], size, cutoff, all,
+    blocks=[(ufirst, tfirst), ...]).
+    Each file line is 'ureads fname prolog', as fasta2DB writes it:
+    fname is the root of the input file, and prolog the movie name of its reads.
+    'blocks' has nblocks+1 boundaries; block i (1-based) is reads
+    [blocks[i-1], blocks[i]). Before DBsplit, there is one block of every read.
+    """
+    db_fn = db_paths(db_fn)[0]
+    with open(db_fn) as ifs:
+        lines = [line.split() for line in ifs if line.strip()]
+    result = dict(files=list(), blocks=list(), size=None, cutoff=None, all=None)
+    nfiles = int(lines[0][2])
+    for words in lines[1:1 + nfiles]:
+        result['files'].append((int(words[0]), words[1], words[2]))
+    rest = lines[1 + nfiles:]
+    if rest and rest[0][0] == 'blocks':
+        params = rest[1]
+        result['size'] = int(params[2])
+        result['cutoff'] = int(params[5])
+        result['all'] = int(params[8])
+        for words in rest[2:]:
+            result['blocks'].append((int(words[0]), int(words[1])))
+    else:
+        nreads = result['files'][-1][0] if result['files'] else 0
+        result['blocks'] = [(0, 0), (nreads, nreads)]
+    return result
+
+
+def meta_fn(db_fn):
+    """'.raw_reads.meta.json', beside raw_reads.db
+    """
+    dirname, basename = os.path.split(db_paths(db_fn)[0])
+    return os.path.join(dirname, '.{}.meta.json'.format(basename[:-3]))
+
+
+def stamp(db_fn):
+    """Return what must match for the sidecar to be current:
+    [size and mtime of the .db, mtime of its directory].
+    Adding or removing a track changes the directory; DBsplit changes the .db.
+    """
+    db_fn = db_paths(db_fn)[0]
+    st = os.stat(db_fn)
+    return [st.st_size, st.st_mtime, os.stat(os.path.dirname(db_fn) or '.').st_mtime]
+
+
+class DazzlerDB(object):
+    """Metadata of one Dazzler DB. Use load(), which prefers the sidecar.
+    """
+
+    def __init__(self, db_fn, meta):
+        self.db_fn = db_paths(db_fn)[0]
+        self.dirname, basename = os.path.split(self.db_fn)
+        self.name = basename[:-3]
+        self.meta = meta
+
+    @classmethod
+    def scan(cls, db_fn):
+        """Read the .db, and list its directory once.
+        """
+        db_fn = db_paths(db_fn)[0]
+        dirname, basename = os.path.split(db_fn)
+        name = basename[:-3]
+        meta = dict(version=META_VERSION, stamp=stamp(db_fn))
+        meta.update(read_db(db_fn))
+        prefix = '.{}.'.format(name)
+        skip = os.path.basename(meta_fn(db_fn))
+        sizes = {basename: os.path.getsize(db_fn)}
+        for fn in sorted(os.listdir(dirname or '.')):
+            if not fn.startswith(prefix) or fn == skip:
+                continue
+            path = os.path.join(dirname, fn)
+            # None for a broken symlink.
+            sizes[fn] = os.path.getsize(path) if os.path.exists(path) else None
+        meta['sizes'] = sizes
+        LOG.debug('Scanned {!r}: {} blocks, {} hidden files'.format(
+            db_fn, len(meta['blocks']) - 1, len(sizes) - 1))
+        return cls(db_fn, meta)
+
+    @classmethod
+    def load(cls, db_fn, cache=True):
+        """From the sidecar, if it is current. Otherwise scan(), and
+        (if cache) rewrite the sidecar for the next stage.
+        """
+        fn = meta_fn(db_fn)
+        if os.path.exists(fn):
+            try:
+                meta = io_io.deserialize(fn)
+            except ValueError:
+                LOG.warning('Ignoring unreadable {!r}'.format(fn))
+            else:
+                if meta.get('version') == META_VERSION and meta['stamp'] == stamp(db_fn):
+                    return cls(db_fn, meta)
+                LOG.info('{!r} is out-of-date.'.format(fn))
+        db = cls.scan(db_fn)
+        if cache:
+            db.save()
+        return db
+
+    def save(self):
+        """Write the sidecar, unless the DB changed since we scanned it.
+        This is only a cache, so a read-only DB directory is not an error.
+        """
+        fn = meta_fn(self.db_fn)
+        if stamp(self.db_fn) != self.meta['stamp']:
+            LOG.info('{!r} changed while we read it; not caching.'.format(self.db_fn))
+            return
+        try:
+            # Creating the sidecar changes the directory mtime, so re-stamp,
+            # then rewrite in place (which does not).
+            io_io.serialize(fn, self.meta)
+            self.meta['stamp'] = stamp(self.db_fn)
+            io_io.serialize(fn, self.meta)
+        except (IOError, OSError) as exc:
+            LOG.warning('Could not write {!r}: {}'.format(fn, exc))
+
+    @property
+    def files(self):
+        """[(last ureads, fname, prolog), ...], as in the .db file lines.
+        """
+        return [tuple(f) for f in self.meta['files']]
+
+    @property
+    def blocks(self):
+        """[(ufirst, tfirst), ...], nblocks+1 boundaries.
+        """
+        return [tuple(b) for b in self.meta['blocks']]
+
+    @property
+    def nreads(self):
+        """Untrimmed reads, from the last file line.
+        """
+        files = self.meta['files']
+        return files[-1][0] if files else 0
+
+    @property
+    def nblocks(self):
+        return max(1, len(self.meta['blocks']) - 1)
+
+    def block_reads(self, block):
+        """Return ((ufirst, ulast+1), (tfirst, tlast+1)) of block (1-based),
+        in the untrimmed and trimmed DB.
+        """
+        (u0, t0), (u1, t1) = self.meta['blocks'][block - 1:block + 1]
+        return (u0, u1), (t0, t1)
+
+    @property
+    def sizes(self):
+        """{basename: bytes} of the .db and its hidden files.
+        """
+        return self.meta['sizes']
+
+    @property
+    def tracks(self):
+        """Names of the tracks of the whole DB, e.g. ['dust', 'tan'].
+        """
+        return sorted(mo.group(2) for mo in self._annos() if not mo.group(1))
+
+    @property
+    def block_tracks(self):
+        """{track: [block, ...]} of the per-block tracks, before Catrack.
+        """
+        result = dict()
+        for mo in self._annos():
+            if mo.group(1):
+                result.setdefault(mo.group(2), list()).append(int(mo.group(1)))
+        return dict((track, sorted(blocks)) for (track, blocks) in result.items())
+
+    def _annos(self):
+        prefix = '.{}.'.format(self.name)
+        for fn in self.meta['sizes']:
+            if fn.startswith(prefix):
+                mo = re_anno.search(fn[len(prefix):])
+                if mo:
+                    yield mo
+
+    def symlink_into(self):
+        """Symlink the .db and its needed hidden files into cwd,
+        since daligner and friends write tracks beside the DB.
+        Return the DB name.
+        """
+        io_io.symlink(self.db_fn)
+        prefix = '.{}.'.format(self.name)
+        for fn in sorted(self.meta['sizes']):
+            if not fn.startswith(prefix) or not re_linked.search(fn[len(prefix):]):
+                continue
+            path = os.path.join(self.dirname, fn)
+            if self.meta['sizes'][fn] is not None:
+                io_io.symlink(path)
+            else:
+                LOG.warning('Symlink {!r} seems to be broken.'.format(path))
+        return self.name
+
+
+def cmd_nblocks(args):
+    sys.stdout.write('{}'.format(DazzlerDB.load(args.db).nblocks))
+
+
+def cmd_nreads(args):
+    sys.stdout.write('{}'.format(DazzlerDB.load(args.db).nreads))
+
+
+def cmd_show(args):
+    io_io.write_as_json(sys.stdout, DazzlerDB.load(args.db, cache=not args.no_cache).meta)
+    sys.stdout.write('\n')
+
+
+class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Dazzler DB metadata, cached beside the DB.',
+        epilog=__doc__,
+        formatter_class=HelpF,
+    )
+    subparsers = parser.add_subparsers(help='sub-command help')
+
+    parser_nblocks = subparsers.add_parser('nblocks', formatter_class=HelpF,
+            help='Print the number of blocks (no newline), and refresh the sidecar.')
+    parser_nblocks.add_argument('db', help='Dazzler DB, e.g. raw_reads.db')
+    parser_nblocks.set_defaults(func=cmd_nblocks)
+
+    parser_nreads = subparsers.add_parser('nreads', formatter_class=HelpF,
+            help='Print the number of (untrimmed) reads (no newline), and refresh the sidecar.')
+    parser_nreads.add_argument('db', help='Dazzler DB, e.g. raw_reads.db')
+    parser_nreads.set_defaults(func=cmd_nreads)
+
+    parser_show = subparsers.add_parser('show', formatter_class=HelpF,
+            help='Print the metadata as JSON.')
+    parser_show.add_argument('--no-cache', action='store_true',
+            help='Do not write the sidecar.')
+    parser_show.add_argument('db', help='Dazzler DB, e.g. raw_reads.db')
+    parser_show.set_defaults(func=cmd_show)
+
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv)          # pragma: no cover
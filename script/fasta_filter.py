@@ -1,14 +1,22 @@
 #! /usr/bin/env python2.7
 
 import FastaReader as FastaReader
+import io_io
 
 import os
 import sys
 import argparse
+import array
 import collections
+import heapq
 import itertools
 import logging
 import contextlib
+import md5
+import multiprocessing
+import shutil
+import struct
+import zlib
 
 LOG = logging.getLogger()
 
@@ -59,6 +67,52 @@ def internal_median_zmw_subread(zmw_subreads):
 
     return selected_subread
 
+##############################
+### Minimum-length filter. ###
+##############################
+class LengthFilter(object):
+    """Call with a read length: True if the read should be kept.
+    Also counts the lengths kept, for a histogram.
+    Applied after ZMW selection, so a ZMW whose selected subread is short is dropped.
+    """
+    def __init__(self, min_length=0):
+        self.min_length = min_length
+        self.kept = collections.Counter()
+        self.ndropped = 0
+        self.dropped_bases = 0
+
+    def __call__(self, length):
+        if length < self.min_length:
+            self.ndropped += 1
+            self.dropped_bases += length
+            return False
+        self.kept[length] += 1
+        return True
+
+    def update(self, other):
+        self.kept.update(other.kept)
+        self.ndropped += other.ndropped
+        self.dropped_bases += other.dropped_bases
+
+    def log_summary(self):
+        nkept = sum(self.kept.values())
+        kept_bases = sum(length * count for (length, count) in self.kept.items())
+        LOG.info('Kept {:,d} reads ({:,d} bases); dropped {:,d} reads ({:,d} bases) shorter than {}'.format(
+            nkept, kept_bases, self.ndropped, self.dropped_bases, self.min_length))
+
+    def write_histogram(self, fn):
+        """Write the kept read-lengths as JSON, longest first.
+        """
+        histogram = sorted(self.kept.items(), reverse=True)
+        io_io.serialize(fn, dict(
+            min_length=self.min_length,
+            nreads=sum(self.kept.values()),
+            nbases=sum(length * count for (length, count) in histogram),
+            ndropped=self.ndropped,
+            dropped_bases=self.dropped_bases,
+            histogram=[[length, count] for (length, count) in histogram],
+        ))
+
 ##############################
 ### Streamed-median filter ###
 ##############################
@@ -71,74 +125,772 @@ def yield_zmwtuples(records):
                         subread_header=record.name, subread_id=0)
         yield zrec
 
-def run_streamed_median(fp_in, fp_out, fn='-', zmw_filter_func=median_zmw_subread):
-    fasta_records = FastaReader.yield_fasta_records(fp_in, fn, log=LOG.info)
-    for zmw_id, zmw_subreads in itertools.groupby(yield_zmwtuples(fasta_records), lambda x: x.zmw_id):
-        median_zrec = median_zmw_subread(list(zmw_subreads))
-        fp_out.write(str(median_zrec.subread_record))
-        fp_out.write('\n')
+def run_streamed_median(fp_in, writer, fn='-', zmw_filter_func=median_zmw_subread, length_filter=None):
+    if length_filter is None:
+        length_filter = LengthFilter()
+    fasta_records = FastaReader.yield_fasta_records_from_blocks(fp_in, fn, log=LOG.info)
+    for zmw_key, zmw_subreads in itertools.groupby(yield_zmwtuples(fasta_records), lambda x: (x.movie_name, x.zmw_id)):
+        median_zrec = zmw_filter_func(list(zmw_subreads))
+        if not length_filter(median_zrec.seq_len):
+            continue
+        writer.write_record(median_zrec.subread_record)
+
+##########################################
+### External-memory streamed median.   ###
+##########################################
+RUN_ENTRY_BYTES = 256  # rough in-memory cost of one run entry
+MERGE_FANIN = 128  # max runs open at once
+
+def write_run(entries, fn):
+    entries.sort()
+    with open(fn, 'w') as ofs:
+        for entry in entries:
+            ofs.write('\t'.join(str(val) for val in entry))
+            ofs.write('\n')
+
+def yield_run(fn):
+    with open(fn) as ifs:
+        for line in ifs:
+            movie_name, zmw, ordinal, length, start, end = line.split('\t')
+            yield (movie_name, int(zmw), int(ordinal), int(length), int(start), int(end))
+
+def spill_runs(fp_in, fn, spool_fn, tmpdir, max_entries, columns):
+    """Copy the records of fp_in to spool_fn, formatted for columns.
+    Meanwhile, write sorted runs of (movie, zmw, ordinal, length, start, end),
+    at most max_entries per run.
+    Return (number of records, run filenames).
+    """
+    run_fns = list()
+    entries = list()
+    def spill():
+        run_fn = os.path.join(tmpdir, 'run.{}.txt'.format(len(run_fns)))
+        write_run(entries, run_fn)
+        run_fns.append(run_fn)
+        del entries[:]
+    nrecords = 0
+    with open(spool_fn, 'w') as spool, FastaReader.FastaWriter(spool, columns) as spool_writer:
+        for record in FastaReader.yield_fasta_records_from_blocks(fp_in, fn, log=LOG.info):
+            movie_name, zmw_id, subread_start, subread_end = tokenize_header(record.name)
+            entries.append((movie_name, int(zmw_id), nrecords, len(record.sequence),
+                            subread_start, subread_end))
+            spool_writer.write_record(record)
+            nrecords += 1
+            if len(entries) >= max_entries:
+                spill()
+    if entries:
+        spill()
+    return nrecords, run_fns
+
+def merge_runs(run_fns, tmpdir):
+    """Merge runs until at most MERGE_FANIN remain, to bound open files.
+    """
+    generation = 0
+    while len(run_fns) > MERGE_FANIN:
+        merged_fns = list()
+        for i in range(0, len(run_fns), MERGE_FANIN):
+            group = run_fns[i:i + MERGE_FANIN]
+            merged_fn = os.path.join(tmpdir, 'merged.{}.{}.txt'.format(generation, len(merged_fns)))
+            with open(merged_fn, 'w') as ofs:
+                for entry in heapq.merge(*[yield_run(run_fn) for run_fn in group]):
+                    ofs.write('\t'.join(str(val) for val in entry))
+                    ofs.write('\n')
+            io_io.rm_force(*group)
+            merged_fns.append(merged_fn)
+        run_fns = merged_fns
+        generation += 1
+    return run_fns
+
+def run_external_median(fp_in, writer, fn='-', zmw_filter_func=median_zmw_subread, max_mem=2**30,
+                        length_filter=None):
+    """Like run_streamed_median(), but the subreads of a ZMW need not be contiguous.
+    The input is spooled to a temp-file, and the ZMW info is grouped
+    by an external merge-sort using about max_mem bytes.
+    Output is in input order.
+    """
+    if length_filter is None:
+        length_filter = LengthFilter()
+    max_entries = max(1, max_mem // RUN_ENTRY_BYTES)
+    with io_io.TemporaryDirectory() as tmpdir:
+        spool_fn = os.path.join(tmpdir, 'spool.fasta')
+        nrecords, run_fns = spill_runs(fp_in, fn, spool_fn, tmpdir, max_entries, writer.columns)
+        LOG.info('Spooled {:,d} subreads, in {} sorted runs'.format(nrecords, len(run_fns)))
+        run_fns = merge_runs(run_fns, tmpdir)
+
+        # One byte per subread, to mark the selected ones.
+        selected = bytearray(nrecords)
+        nselected = 0
+        entries = heapq.merge(*[yield_run(run_fn) for run_fn in run_fns])
+        for (movie_name, zmw), group in itertools.groupby(entries, lambda entry: entry[:2]):
+            zmw_subreads = [ZMWTuple(movie_name=movie_name, zmw_id=str(zmw),
+                                     subread_start=start, subread_end=end,
+                                     seq_len=length, subread_record=None,
+                                     subread_header=None, subread_id=ordinal)
+                            for (_, _, ordinal, length, start, end) in group]
+            zrec = zmw_filter_func(zmw_subreads)
+            if length_filter(zrec.seq_len):
+                selected[zrec.subread_id] = 1
+                nselected += 1
+        LOG.info('Selected {:,d} subreads'.format(nselected))
+        io_io.logstats()
+
+        # The spool is already formatted, so the selected records are copied verbatim.
+        with FastaReader.open_mmap(spool_fn) as mapped:
+            views = FastaReader.yield_mmap_fasta_records(mapped, spool_fn, log=LOG.debug)
+            for ordinal, view in enumerate(views):
+                if selected[ordinal]:
+                    writer.write_record(view)
 
 ##############################
 ### Pass filter.           ###
 ##############################
-def run_pass_filter(fp_in, fp_out, fn):
-    for record in FastaReader.yield_fasta_records(fp_in, fn, log=LOG.info):
-        fp_out.write(str(record))
-        fp_out.write('\n')
+def run_pass_filter(fp_in, writer, fn, length_filter=None):
+    if length_filter is None:
+        length_filter = LengthFilter()
+    for record in FastaReader.yield_fasta_records_from_blocks(fp_in, fn, log=LOG.info):
+        if not length_filter(len(record.sequence)):
+            continue
+        writer.write_record(record)
+
+##############################
+### Sharded, parallel.     ###
+##############################
+SHARD_BYTES = 64 * 2**20
+
+def pass_shard(fn, start, end, min_length=0, columns=FastaReader.FastaRecord.COLUMNS):
+    """Return the formatted records in bytes [start, end) of fn,
+    and the LengthFilter applied to them.
+    """
+    length_filter = LengthFilter(min_length)
+    shard_out = io_io.NativeIO()
+    with open(fn) as fp_in, FastaReader.FastaWriter(shard_out, columns) as writer:
+        records = FastaReader.yield_fasta_records_from_blocks(
+            FastaReader.RangeReader(fp_in, start, end), fn, log=LOG.debug)
+        for record in records:
+            if length_filter(len(record.sequence)):
+                writer.write_record(record)
+    return shard_out.getvalue(), length_filter
+
+def run_sharded(fn, writer, shard_func, nproc, length_filter=None, shard_bytes=SHARD_BYTES):
+    """Apply shard_func(fn, start, end, min_length, columns) to record-aligned byte-ranges of fn
+    on a process pool, and write the results in the original order.
+    shard_func returns (text, LengthFilter).
+    At most 2*nproc shards are in flight, so a slow consumer of the output
+    (e.g. fasta2DB) also bounds our memory.
+    """
+    if length_filter is None:
+        length_filter = LengthFilter()
+    def write(result):
+        text, shard_filter = result
+        writer.write_raw(text)
+        length_filter.update(shard_filter)
+    shards = FastaReader.get_fasta_shards(fn, shard_bytes)
+    LOG.info('Filtering {} shards of {!r} on {} processes'.format(len(shards), fn, nproc))
+    pool = multiprocessing.Pool(nproc)
+    try:
+        pending = collections.deque()
+        for (start, end) in shards:
+            pending.append(pool.apply_async(io_io.run_func,
+                    ((shard_func, fn, start, end, length_filter.min_length, writer.columns),)))
+            if len(pending) >= 2 * nproc:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
 
 ##################################
 ### Double-pass median filter. ###
 ##################################
-def run_median_filter(fp_in, fp_out, fn, zmw_filter_func=median_zmw_subread):
+class ZMWStore(object):
+    """Compact, columnar metadata for every subread in a file.
+    Row i is the i-th subread. Movie names are interned; everything else
+    is a parallel integer array, so a subread costs ~44 bytes, not a namedtuple
+    with its header.
+    """
+    def __init__(self):
+        self.movie_names = list()
+        self.movie_index = dict()
+        self.movie = array.array('i')
+        self.zmw = array.array('l')
+        self.start = array.array('l')
+        self.end = array.array('l')
+        self.length = array.array('l')
+        self.offset = array.array('l')  # byte offset of the record in the file
+
+    def __len__(self):
+        return len(self.zmw)
+
+    def append(self, tokens, length, offset):
+        """tokens: from tokenize_header()
+        """
+        movie_name, zmw_id, subread_start, subread_end = tokens
+        movie = self.movie_index.get(movie_name)
+        if movie is None:
+            movie = self.movie_index[movie_name] = len(self.movie_names)
+            self.movie_names.append(movie_name)
+        self.movie.append(movie)
+        self.zmw.append(int(zmw_id))
+        self.start.append(subread_start)
+        self.end.append(subread_end)
+        self.length.append(length)
+        self.offset.append(offset)
+
+    def columns(self):
+        """Return the columns as numpy arrays (without copying), plus the ordinals.
+        """
+        import numpy as np
+        def col(arr):
+            return np.frombuffer(arr, dtype=np.dtype(arr.typecode)) if len(arr) else np.zeros(0, dtype=np.int64)
+        return (col(self.movie), col(self.zmw), col(self.start), col(self.length),
+                np.arange(len(self), dtype=np.int64))
+
+    def zmwtuples(self, rows):
+        return [ZMWTuple(movie_name=self.movie_names[self.movie[row]], zmw_id=str(self.zmw[row]),
+                         subread_start=self.start[row], subread_end=self.end[row],
+                         seq_len=self.length[row], subread_record=None,
+                         subread_header=None, subread_id=row)
+                for row in rows]
+
+
+def collect_zmw_store(mapped, fn):
+    """Collect the ZMW info and offset of each subread in the memory-mapped file.
+    """
+    store = ZMWStore()
+    for view in FastaReader.yield_mmap_fasta_records(mapped, fn, log=LOG.info):
+        store.append(tokenize_header(view.name), view.length, view.offset)
+    return store
+
+
+def _group_bounds(np, movie, zmw):
+    """Given movie/zmw sorted so that each ZMW is contiguous,
+    return (first-row, count) of each group.
+    """
+    n = len(zmw)
+    if not n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    change = np.empty(n, dtype=bool)
+    change[0] = True
+    change[1:] = (movie[1:] != movie[:-1]) | (zmw[1:] != zmw[:-1])
+    firsts = np.flatnonzero(change)
+    counts = np.diff(np.append(firsts, n))
+    return firsts, counts
+
+
+def select_median_rows(store):
+    """Vectorized median_zmw_subread() over every ZMW.
+    Return the selected rows (ordinals), sorted.
+    """
+    import numpy as np
+    movie, zmw, start, length, ordinal = store.columns()
+    # Within a ZMW, sort by length, ties in input order (like the stable sorted()).
+    order = np.lexsort((ordinal, length, zmw, movie))
+    firsts, counts = _group_bounds(np, movie[order], zmw[order])
+    return np.sort(order[firsts + counts // 2])
+
+
+def select_internal_median_rows(store):
+    """Vectorized internal_median_zmw_subread() over every ZMW.
+    Return the selected rows (ordinals), sorted.
+    """
+    import numpy as np
+    movie, zmw, start, length, ordinal = store.columns()
+    # Rank each subread by position within its ZMW, to drop the first and last.
+    by_pos = np.lexsort((ordinal, start, zmw, movie))
+    firsts, counts = _group_bounds(np, movie[by_pos], zmw[by_pos])
+    rank = np.empty(len(ordinal), dtype=np.int64)
+    rank[by_pos] = np.arange(len(ordinal)) - np.repeat(firsts, counts)
+    count = np.empty(len(ordinal), dtype=np.int64)
+    count[by_pos] = np.repeat(counts, counts)
+    internal = (count < 3) | ((rank > 0) & (rank < count - 1))
+    rows = np.flatnonzero(internal)
+    # Sort by length. Ties: for >= 3 subreads by position, as sorted() is stable over
+    # the by-position list; for < 3, in input order, as sorted() is over the input.
+    tie = np.where(count[rows] < 3, 0, start[rows])
+    order = rows[np.lexsort((ordinal[rows], tie, length[rows], zmw[rows], movie[rows]))]
+    firsts, counts = _group_bounds(np, movie[order], zmw[order])
+    # < 3 subreads: the longest. Otherwise, the median of the internal ones.
+    small = count[order[firsts]] < 3
+    picks = np.where(small, firsts + counts - 1, firsts + counts // 2)
+    return np.sort(order[picks])
+
+
+VECTORIZED_SELECTORS = {
+    median_zmw_subread: select_median_rows,
+    internal_median_zmw_subread: select_internal_median_rows,
+}
+
+
+def select_rows(store, zmw_filter_func):
+    """Return the sorted rows chosen by zmw_filter_func, one per ZMW.
+    """
+    selector = VECTORIZED_SELECTORS.get(zmw_filter_func)
+    if selector:
+        return selector(store)
+    # Any other filter gets ZMWTuples (whose subread_id is the row).
+    groups = collections.defaultdict(list)
+    for row in range(len(store)):
+        groups[(store.movie[row], store.zmw[row])].append(row)
+    return sorted(zmw_filter_func(store.zmwtuples(rows)).subread_id
+                  for rows in groups.itervalues())
+
+
+def run_median_filter(fp_in, writer, fn, zmw_filter_func=median_zmw_subread, length_filter=None):
+    """Parse once, remembering where each subread is in the memory-mapped file.
+    Then write only the selected subreads, in input order, straight from the map.
+    Subreads are grouped by (movie, zmw).
+    """
     # Expect an actual file, not a stream.
     assert(os.path.exists(fn))
+    if length_filter is None:
+        length_filter = LengthFilter()
 
-    # Needed to jump back for the second pass.
-    fp_in_start = fp_in.tell()
+    with FastaReader.open_mmap(fn) as mapped:
+        # Single pass, collect all ZMW info, and the offsets of each subread.
+        store = collect_zmw_store(mapped, fn)
+        LOG.info('Collected {:,d} subreads from {:,d} movie(s)'.format(
+            len(store), len(store.movie_names)))
+        io_io.logstats()
 
-    # Stores all subreads for a ZMW.
-    zmw_dict = collections.defaultdict(list)
+        # For each ZMW, keep only one particular subread.
+        rows = select_rows(store, zmw_filter_func)
+        LOG.info('Selected {:,d} subreads'.format(len(rows)))
+        io_io.logstats()
 
-    # First pass, collect all ZMW info.
-    for record in FastaReader.yield_fasta_records(fp_in, fn, log=LOG.info):
-        movie_name, zmw_id, subread_start, subread_end = tokenize_header(record.name)
-        # Store None instead of the actual record to free the memory after yield.
-        zrec = ZMWTuple(movie_name=movie_name, zmw_id=zmw_id,
-                        subread_start=subread_start, subread_end=subread_end,
-                        seq_len=len(record.sequence), subread_record=None,
-                        subread_header=record.name, subread_id=len(zmw_dict[zmw_id]))
-        zmw_dict[zmw_id].append(zrec)
-
-    # For each ZMW, keep only one particular subread, specified by it's order of
-    # appearance in the input FASTA file (stored in median_zrec.subread_id).
-    whitelist = collections.defaultdict(int)
-    for zmw_id, zmw_subreads in zmw_dict.iteritems():
-        median_zrec = zmw_filter_func(list(zmw_subreads))
-        whitelist[zmw_id] = median_zrec.subread_id
+        # Write them in their order in the input file.
+        for row in rows:
+            if not length_filter(store.length[row]):
+                continue
+            writer.write_record(FastaReader.view_at(mapped, store.offset[row]))
 
-    # Second pass, yield selected sequences.
-    # Rewind.
-    fp_in.seek(fp_in_start, os.SEEK_SET)
-    # Fly-through.
-    for record in FastaReader.yield_fasta_records(fp_in, fn, log=LOG.info):
-        movie_name, zmw_id, subread_start, subread_end = tokenize_header(record.name)
-        # Write-out only one particular subread from the ZMW.
-        if whitelist[zmw_id] == 0:
-            fp_out.write(str(record))
-            fp_out.write('\n')
-        whitelist[zmw_id] -= 1
+#####################################
+### ZMW-partitioned, parallel.    ###
+#####################################
+def zmw_key(seq_header):
+    """Return 'movie_name/zmw_id', without the cost of tokenize_header().
+    """
+    return seq_header.split(None, 1)[0].rsplit('/', 1)[0]
+
+def zmw_partition(key, nparts):
+    """Partition of a zmw_key(). Stable across processes (unlike hash()).
+    """
+    return (zlib.crc32(key) & 0xffffffff) % nparts
+
+def route_shard(fn, start, end, nparts):
+    """Parse only the records starting in bytes [start, end) of fn,
+    and route each to the partition of its ZMW.
+    Return [(offsets, run_starts), ...], one per partition, as strings:
+    the record offsets (an array('l')), and a byte per record, 1 if it begins
+    a run of consecutive subreads of one ZMW (for the streamed filters).
+    """
+    offsets = [array.array('l') for _ in range(nparts)]
+    run_starts = [bytearray() for _ in range(nparts)]
+    with FastaReader.open_mmap(fn) as mapped:
+        # A run may have begun in the previous shard.
+        prev = FastaReader.view_before(mapped, start) if start else None
+        prev_key = zmw_key(prev.name) if prev else None
+        for view in FastaReader.yield_views_starting_in(mapped, start, end):
+            key = zmw_key(view.name)
+            part = zmw_partition(key, nparts)
+            offsets[part].append(view.offset)
+            run_starts[part].append(key != prev_key)
+            prev_key = key
+    return [(o.tostring(), str(r)) for (o, r) in zip(offsets, run_starts)]
+
+def median_partition(fn, offsets, run_starts, zmw_filter_func):
+    """Apply zmw_filter_func to the ZMWs of fn in one partition,
+    given the offsets of their subreads (from route_shard()).
+    Return the byte offsets of the selected subreads, sorted.
+    """
+    store = ZMWStore()
+    with FastaReader.open_mmap(fn) as mapped:
+        for offset in array.array('l', offsets):
+            view = FastaReader.view_at(mapped, offset)
+            store.append(tokenize_header(view.name), view.length, offset)
+    rows = select_rows(store, zmw_filter_func)
+    return array.array('l', (store.offset[row] for row in rows))
+
+def streamed_median_partition(fn, offsets, run_starts, zmw_filter_func):
+    """Like median_partition(), but a ZMW is each run of consecutive subreads,
+    as in run_streamed_median().
+    """
+    selected = array.array('l')
+    with FastaReader.open_mmap(fn) as mapped:
+        def select(group):
+            zmw_subreads = [ZMWTuple(*tokenize_header(view.name),
+                                     seq_len=view.length, subread_record=view,
+                                     subread_header=view.name, subread_id=view.offset)
+                            for view in group]
+            selected.append(zmw_filter_func(zmw_subreads).subread_id)
+        group = list()
+        for offset, run_start in itertools.izip(array.array('l', offsets), bytearray(run_starts)):
+            if run_start and group:
+                select(group)
+                group = list()
+            group.append(FastaReader.view_at(mapped, offset))
+        if group:
+            select(group)
+    return selected
+
+def run_partitioned(fn, writer, partition_func, zmw_filter_func, nproc, length_filter=None,
+        shard_bytes=SHARD_BYTES):
+    """Parse record-aligned byte-ranges of fn on a process pool, routing each
+    subread to one of nproc partitions of the ZMWs (see route_shard()).
+    Then run partition_func(fn, offsets, run_starts, zmw_filter_func) for each
+    partition, and write the selected subreads in their order in fn.
+    Each partition re-reads only its own subreads, so fn is parsed about twice in all,
+    no matter what nproc is.
+    """
+    if length_filter is None:
+        length_filter = LengthFilter()
+    shards = FastaReader.get_fasta_shards(fn, shard_bytes)
+    LOG.info('Filtering {!r} ({} shards) in {} ZMW partitions'.format(fn, len(shards), nproc))
+    pool = multiprocessing.Pool(nproc)
+    try:
+        routed = pool.map(io_io.run_func,
+                [(route_shard, fn, start, end, nproc) for (start, end) in shards])
+        # Concatenated in shard order, each partition's offsets stay sorted.
+        parts = [(''.join(shard[part][0] for shard in routed),
+                  ''.join(shard[part][1] for shard in routed))
+                 for part in range(nproc)]
+        del routed
+        results = pool.map(io_io.run_func,
+                [(partition_func, fn, offsets, run_starts, zmw_filter_func)
+                 for (offsets, run_starts) in parts])
+        del parts
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    LOG.info('Selected {:,d} subreads'.format(sum(len(offsets) for offsets in results)))
+    with FastaReader.open_mmap(fn) as mapped:
+        for offset in heapq.merge(*results):
+            view = FastaReader.view_at(mapped, offset)
+            if not length_filter(view.length):
+                continue
+            writer.write_record(view)
+
+##############################
+### Exact-duplicate filter. ###
+##############################
+DIGEST_ENTRY = struct.Struct('<16sQ')  # md5 digest, ordinal
+DIGEST_SORT_FACTOR = 2  # sorting a table of entries takes about this many times its size
+
+def digest_dtype():
+    """The numpy view of packed DIGEST_ENTRYs. The digest is split into
+    two big-endian words, so sorting them sorts by digest.
+    """
+    import numpy as np
+    return np.dtype([('hi', '>u8'), ('lo', '>u8'), ('ordinal', '<u8')])
+
+def duplicates_in(data):
+    """Return the ordinals of every entry but the first of each digest,
+    for packed DIGEST_ENTRYs (a buffer) in increasing ordinal order.
+    """
+    import numpy as np
+    entries = np.frombuffer(data, dtype=digest_dtype())
+    # lexsort is stable, so the first of a run of equal digests is the earliest read.
+    order = np.lexsort((entries['lo'], entries['hi']))
+    hi = entries['hi'][order]
+    lo = entries['lo'][order]
+    repeat = np.zeros(len(order), dtype=bool)
+    repeat[1:] = (hi[1:] == hi[:-1]) & (lo[1:] == lo[:-1])
+    return entries['ordinal'][order[repeat]]
+
+def yield_ints(arr, chunk=2**16):
+    """Yield the values of a numpy array as ints, without a list of all of them.
+    """
+    for i in range(0, len(arr), chunk):
+        for value in arr[i:i + chunk].tolist():
+            yield value
+
+class DigestTable(object):
+    """Find the ordinals of reads whose sequence digest was already seen.
+    Entries are fixed-width (digest, ordinal) records, 24 bytes each, packed
+    in a bytearray. Beyond about max_mem bytes (0 means no limit) they are
+    appended to a spill file. At the end, the spill is split by digest into
+    just enough partitions that each can be sorted within max_mem.
+    Reads must be added in ordinal order.
+    """
+    def __init__(self, tmpdir, max_mem=0):
+        self.tmpdir = tmpdir
+        self.max_bytes = max_mem // DIGEST_SORT_FACTOR // DIGEST_ENTRY.size * DIGEST_ENTRY.size
+        if max_mem:
+            self.max_bytes = max(DIGEST_ENTRY.size, self.max_bytes)
+        self.entries = bytearray()
+        self.spill = None
+        self.nspilled = 0
+
+    def add(self, digest, ordinal):
+        self.entries += DIGEST_ENTRY.pack(digest, ordinal)
+        if self.max_bytes and len(self.entries) >= self.max_bytes:
+            self._spill()
+
+    def extend(self, data):
+        """Add packed DIGEST_ENTRYs, e.g. from load_digests().
+        """
+        self.entries += data
+        if self.max_bytes and len(self.entries) >= self.max_bytes:
+            self._spill()
+
+    def _spill(self):
+        if self.spill is None:
+            self.spill = open(os.path.join(self.tmpdir, 'digests.bin'), 'wb')
+        self.spill.write(self.entries)
+        self.nspilled += len(self.entries)
+        self.entries = bytearray()
+
+    def _partition(self, nparts):
+        """Split the spill by digest into nparts files, opening at most
+        MERGE_FANIN at a time. Each keeps the ordinal order of the spill.
+        """
+        import numpy as np
+        fns = [os.path.join(self.tmpdir, 'digests.{}.bin'.format(i)) for i in range(nparts)]
+        for first in range(0, nparts, MERGE_FANIN):
+            last = min(nparts, first + MERGE_FANIN)
+            outs = [open(fn, 'wb') for fn in fns[first:last]]
+            with open(self.spill.name, 'rb') as ifs:
+                while True:
+                    data = ifs.read(self.max_bytes)
+                    if not data:
+                        break
+                    entries = np.frombuffer(data, dtype=digest_dtype())
+                    # The top 32 bits of the digest, scaled to [0, nparts).
+                    part = ((entries['hi'] >> np.uint64(32)) * np.uint64(nparts)) >> np.uint64(32)
+                    order = np.argsort(part, kind='mergesort')  # stable, to keep ordinal order
+                    splits = np.searchsorted(part[order], np.arange(first, last + 1))
+                    for k, out in enumerate(outs):
+                        out.write(entries[order[splits[k]:splits[k + 1]]].tobytes())
+            for out in outs:
+                out.close()
+        return fns
+
+    def yield_duplicates(self):
+        """Yield the ordinal of every read but the first with a given digest
+        (in no particular order).
+        """
+        if self.spill is None:
+            for ordinal in yield_ints(duplicates_in(self.entries)):
+                yield ordinal
+            return
+        self._spill()
+        self.spill.close()
+        nparts = max(1, -(-self.nspilled // self.max_bytes))
+        LOG.info('Partitioning {:,d} spilled digests into {} partitions'.format(
+            self.nspilled // DIGEST_ENTRY.size, nparts))
+        fns = self._partition(nparts)
+        os.remove(self.spill.name)
+        for fn in fns:
+            with open(fn, 'rb') as ifs:
+                data = ifs.read()
+            os.remove(fn)
+            for ordinal in yield_ints(duplicates_in(data)):
+                yield ordinal
+
+def spool_records(fp_in, fn, spool_fn, columns):
+    """Write the records of fp_in to spool_fn, formatted for columns.
+    """
+    with open(spool_fn, 'w') as spool, FastaReader.FastaWriter(spool, columns) as spool_writer:
+        for record in FastaReader.yield_fasta_records_from_blocks(fp_in, fn, log=LOG.info):
+            spool_writer.write_record(record)
+
+def load_digests(table, digests_fn):
+    """Add the entries of digests_fn (if any) to table, as reads seen before this input.
+    Return how many.
+    """
+    if not digests_fn or not os.path.exists(digests_fn):
+        return 0
+    nbytes = 0
+    with open(digests_fn, 'rb') as ifs:
+        while True:
+            data = ifs.read(DIGEST_ENTRY.size * 2**16)
+            if not data:
+                break
+            table.extend(data)
+            nbytes += len(data)
+    if nbytes % DIGEST_ENTRY.size:
+        raise Exception('{!r} is truncated ({} bytes).'.format(digests_fn, nbytes))
+    return nbytes // DIGEST_ENTRY.size
+
+def run_dedup_filter(fp_in, writer, fn='-', max_mem=0, length_filter=None, digests_fn=None):
+    """Drop each read whose sequence is exactly that of an earlier read,
+    by md5 digest. Input from a stream is spooled to a temp-file first,
+    since we need two passes.
+    Without digests_fn, only this input is deduplicated. With it, reads already
+    in digests_fn (from earlier inputs) are dropped too, and the digest of each
+    read we write is appended to it, once all are written.
+    """
+    if length_filter is None:
+        length_filter = LengthFilter()
+    with io_io.TemporaryDirectory() as tmpdir:
+        if fn == '-':
+            spool_fn = os.path.join(tmpdir, 'spool.fasta')
+            spool_records(fp_in, fn, spool_fn, writer.columns)
+            fn = spool_fn
+        table = DigestTable(tmpdir, max_mem)
+        # Earlier digests are unique, and precede ours, so they are never reported.
+        nseen = load_digests(table, digests_fn)
+        if nseen:
+            LOG.info('Loaded {:,d} digests of earlier reads from {!r}'.format(nseen, digests_fn))
+        with FastaReader.open_mmap(fn) as mapped:
+            nrecords = 0
+            for view in FastaReader.yield_mmap_fasta_records(mapped, fn, log=LOG.info):
+                table.add(md5.md5(view.sequence).digest(), nseen + nrecords)
+                nrecords += 1
+            duplicate = bytearray(nrecords)
+            for ordinal in table.yield_duplicates():
+                duplicate[ordinal - nseen] = 1
+            io_io.logstats()
+
+            nduplicates = duplicate_bases = nwritten = 0
+            new_digests_fn = os.path.join(tmpdir, 'new.digests.bin')
+            with open(new_digests_fn, 'wb') as new_digests:
+                views = FastaReader.yield_mmap_fasta_records(mapped, fn, log=LOG.debug)
+                for ordinal, view in enumerate(views):
+                    if duplicate[ordinal]:
+                        nduplicates += 1
+                        duplicate_bases += view.length
+                        continue
+                    if not length_filter(view.length):
+                        continue
+                    writer.write_record(view)
+                    if digests_fn:
+                        new_digests.write(DIGEST_ENTRY.pack(md5.md5(view.sequence).digest(), nseen + nwritten))
+                    nwritten += 1
+        if digests_fn:
+            with open(new_digests_fn, 'rb') as ifs, open(digests_fn, 'ab') as ofs:
+                shutil.copyfileobj(ifs, ofs)
+    LOG.info('Dropped {:,d} exact-duplicate reads of {:,d}, saving {:,d} bases'.format(
+        nduplicates, nrecords, duplicate_bases))
+
+#######################################
+### Output order, by length.        ###
+#######################################
+ORDER_ENTRY = struct.Struct('<qqq')  # (-longest subread, start, end) of a well
+ORDER_ENTRY_BYTES = 128  # rough in-memory cost of one entry, as a tuple
+ORDER_STRATA = 256  # for 'interleave': every this many wells sample every length stratum
+ORDERS = ('length', 'interleave')
+
+def yield_well_spans(mapped, fn):
+    """Yield (-longest subread, start, end) for each run of consecutive
+    records of one ZMW, as fasta2DB groups them into wells.
+    """
+    key = start = end = None
+    longest = 0
+    for view in FastaReader.yield_mmap_fasta_records(mapped, fn, log=LOG.debug):
+        view_key = zmw_key(view.name)
+        if view_key != key:
+            if key is not None:
+                yield (-longest, start, end)
+            key, start, longest = view_key, view.offset, 0
+        longest = max(longest, view.length)
+        end = view.end
+    if key is not None:
+        yield (-longest, start, end)
+
+def write_entries(entries, fn):
+    with open(fn, 'wb') as ofs:
+        for entry in entries:
+            ofs.write(ORDER_ENTRY.pack(*entry))
+
+def yield_entries(fn):
+    with open(fn, 'rb') as ifs:
+        while True:
+            data = ifs.read(ORDER_ENTRY.size * 4096)
+            if not data:
+                return
+            for i in range(0, len(data), ORDER_ENTRY.size):
+                yield ORDER_ENTRY.unpack_from(data, i)
+
+def sort_entries(entries, tmpdir, max_entries):
+    """External merge-sort of entries into one file of fixed-size ORDER_ENTRYs.
+    Return (filename, number of entries).
+    """
+    run_fns = list()
+    run = list()
+    n = 0
+    def spill():
+        run.sort()
+        run_fn = os.path.join(tmpdir, 'order.{}.bin'.format(len(run_fns)))
+        write_entries(run, run_fn)
+        run_fns.append(run_fn)
+        del run[:]
+    for entry in entries:
+        run.append(entry)
+        n += 1
+        if len(run) >= max_entries:
+            spill()
+    spill()
+    generation = 0
+    while len(run_fns) > 1:
+        merged_fns = list()
+        for i in range(0, len(run_fns), MERGE_FANIN):
+            group = run_fns[i:i + MERGE_FANIN]
+            merged_fn = os.path.join(tmpdir, 'order.merged.{}.{}.bin'.format(generation, len(merged_fns)))
+            write_entries(heapq.merge(*[yield_entries(fn) for fn in group]), merged_fn)
+            io_io.rm_force(*group)
+            merged_fns.append(merged_fn)
+        run_fns = merged_fns
+        generation += 1
+    return run_fns[0], n
+
+def yield_ranks(n, order):
+    """Yield the length-ranks (0 is the longest) in output order.
+    'interleave' deals the ranks into ORDER_STRATA strata of consecutive ranks,
+    and takes one from each in turn, so any ORDER_STRATA consecutive wells
+    (and so any DB block) have about the same length distribution.
+    >>> list(yield_ranks(5, 'length'))
+    [0, 1, 2, 3, 4]
+    >>> list(yield_ranks(2 * ORDER_STRATA, 'interleave'))[:4]
+    [0, 2, 4, 6]
+    """
+    if order == 'length':
+        for rank in range(n):
+            yield rank
+        return
+    per_stratum = (n + ORDER_STRATA - 1) // ORDER_STRATA
+    for i in range(per_stratum):
+        for rank in range(i, n, per_stratum):
+            yield rank
+
+def write_ordered(spool_fn, writer, order, tmpdir, max_mem=0):
+    """Copy the wells of spool_fn to writer, in the given order.
+    The subreads of a well stay together, in their original order,
+    since fasta2DB groups consecutive subreads of a ZMW into a well.
+    Only the well spans are sorted, externally beyond about max_mem (0 means no limit).
+    """
+    max_entries = max_mem // ORDER_ENTRY_BYTES if max_mem else float('inf')
+    with FastaReader.open_mmap(spool_fn) as mapped:
+        sorted_fn, nwells = sort_entries(yield_well_spans(mapped, spool_fn), tmpdir, max(1, max_entries))
+        LOG.info('Writing {:,d} wells in {!r} order'.format(nwells, order))
+        with FastaReader.open_mmap(sorted_fn) as entries:
+            for rank in yield_ranks(nwells, order):
+                _, start, end = ORDER_ENTRY.unpack_from(entries, rank * ORDER_ENTRY.size)
+                writer.write_raw(mapped[start:end])
+
+def run_ordered(args, writer):
+    """Run the filter into a spool, then write its output to writer in args.order.
+    """
+    with io_io.TemporaryDirectory() as tmpdir:
+        spool_fn = os.path.join(tmpdir, 'ordered.spool.fasta')
+        with open(spool_fn, 'w') as spool, FastaReader.FastaWriter(spool, writer.columns) as args.writer:
+            args.func(args)
+        write_ordered(spool_fn, writer, args.order, tmpdir, args.max_mem * 2**20)
 
 ###############################
 ### Internal median filter. ###
 ###############################
-def run_internal_median_filter(fp_in, fp_out, fn):
-    run_median_filter(fp_in, fp_out, fn, zmw_filter_func=internal_median_zmw_subread)
+def run_internal_median_filter(fp_in, writer, fn):
+    run_median_filter(fp_in, writer, fn, zmw_filter_func=internal_median_zmw_subread)
 
 #######################################
 ### Streamed internal median filter ###
 #######################################
-def run_streamed_internal_median_filter(fp_in, fp_out, fn='-'):
-    run_streamed_median(fp_in, fp_out, fn=fn, zmw_filter_func=internal_median_zmw_subread)
+def run_streamed_internal_median_filter(fp_in, writer, fn='-'):
+    run_streamed_median(fp_in, writer, fn=fn, zmw_filter_func=internal_median_zmw_subread)
 
 ##############################
 ### Main and cmds.         ###
@@ -152,25 +904,57 @@ def open_stream(input_path):
             yield stream
 
 def cmd_run_pass_filter(args):
+    if args.nproc > 1 and args.input_path != '-':
+        run_sharded(args.input_path, args.writer, pass_shard, args.nproc, args.length_filter)
+        return
     with open_stream(args.input_path) as fp_in:
-        run_pass_filter(fp_in, sys.stdout, args.input_path)
+        run_pass_filter(fp_in, args.writer, args.input_path, args.length_filter)
 
-def cmd_run_streamed_median_filter(args):
+def run_streamed(args, zmw_filter_func):
+    if args.max_mem:
+        if args.nproc > 1:
+            LOG.warning('Ignoring --nproc={} with --max-mem.'.format(args.nproc))
+        with open_stream(args.input_path) as fp_in:
+            run_external_median(fp_in, args.writer, args.input_path,
+                    zmw_filter_func=zmw_filter_func, max_mem=args.max_mem * 2**20,
+                    length_filter=args.length_filter)
+        return
+    if args.nproc > 1:
+        if args.input_path != '-':
+            run_partitioned(args.input_path, args.writer, streamed_median_partition, zmw_filter_func, args.nproc,
+                    args.length_filter)
+            return
+        LOG.warning('Ignoring --nproc={} for stdin.'.format(args.nproc))
     with open_stream(args.input_path) as fp_in:
-        run_streamed_median(fp_in, sys.stdout, args.input_path)
+        run_streamed_median(fp_in, args.writer, args.input_path, zmw_filter_func=zmw_filter_func,
+                length_filter=args.length_filter)
 
-def cmd_run_median_filter(args):
+def run_double_pass(args, zmw_filter_func):
+    if args.nproc > 1:
+        run_partitioned(args.input_path, args.writer, median_partition, zmw_filter_func, args.nproc,
+                args.length_filter)
+        return
     # Don't allow '-' for the double-pass median filter.
     with open(args.input_path, 'r') as fp_in:
-        run_median_filter(fp_in, sys.stdout, args.input_path)
+        run_median_filter(fp_in, args.writer, args.input_path, zmw_filter_func=zmw_filter_func,
+                length_filter=args.length_filter)
+
+def cmd_run_dedup_filter(args):
+    with open_stream(args.input_path) as fp_in:
+        run_dedup_filter(fp_in, args.writer, args.input_path, max_mem=args.max_mem * 2**20,
+                length_filter=args.length_filter, digests_fn=args.digests_fn)
+
+def cmd_run_streamed_median_filter(args):
+    run_streamed(args, median_zmw_subread)
+
+def cmd_run_median_filter(args):
+    run_double_pass(args, median_zmw_subread)
 
 def cmd_run_internal_median_filter(args):
-    with open(args.input_path, 'r') as fp_in:
-        run_internal_median_filter(fp_in, sys.stdout, args.input_path)
+    run_double_pass(args, internal_median_zmw_subread)
 
 def cmd_run_streamed_internal_median_filter(args):
-    with open_stream(args.input_path) as fp_in:
-        run_streamed_internal_median_filter(fp_in, sys.stdout, args.input_path)
+    run_streamed(args, internal_median_zmw_subread)
 
 class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
     pass
@@ -184,11 +968,12 @@ def parse_args(argv):
 
     subparsers = parser.add_subparsers(help='sub-command help')
 
-    help_pass = 'The no-op filter - passes every FASTA record to stdout. If input_path is "-", input is read from stdin.'
-    help_median = 'Applies the median-length ZMW filter by running two passes over the data. Only one subread per ZMW is output, based on median-length selection. The input_path needs to be a file.'
-    help_streamed_median = 'Applies the median-length ZMW filter by running a single-pass over the data. The input subreads should be groupped by ZMW. If input_path is "-", input is read from stdin.'
-    help_internal_median = 'Applies the median-length ZMW filter only on internal subreads (ZMWs with >= 3 subreads) by running two passes over the data. For ZMWs with < 3 subreads, the maximum-length one is selected. The input_path needs to be a file.'
-    help_streamed_internal_median = 'Applies the median-length ZMW filter only on internal subreads (ZMWs with >= 3 subreads) by running a single pass over the data. The input subreads should be groupped by ZMW. For ZMWs with < 3 subreads, the maximum-length one is selected. If input_path is "-", input is read from stdin.'
+    help_pass = 'The no-op filter - passes every FASTA record to stdout. If input_path is "-", input is read from stdin. With --nproc > 1 and a file, record-aligned byte-ranges of the file are filtered in parallel, and output in the original order.'
+    help_median = 'Applies the median-length ZMW filter by running two passes over the data. Only one subread per ZMW is output, based on median-length selection. The input_path needs to be a file. With --nproc > 1, ZMWs are partitioned across processes.'
+    help_streamed_median = 'Applies the median-length ZMW filter by running a single-pass over the data. The input subreads should be groupped by ZMW, unless --max-mem is given. If input_path is "-", input is read from stdin. With --nproc > 1 and a file, ZMWs are partitioned across processes.'
+    help_internal_median = 'Applies the median-length ZMW filter only on internal subreads (ZMWs with >= 3 subreads) by running two passes over the data. For ZMWs with < 3 subreads, the maximum-length one is selected. The input_path needs to be a file. With --nproc > 1, ZMWs are partitioned across processes.'
+    help_streamed_internal_median = 'Applies the median-length ZMW filter only on internal subreads (ZMWs with >= 3 subreads) by running a single pass over the data. The input subreads should be groupped by ZMW, unless --max-mem is given. For ZMWs with < 3 subreads, the maximum-length one is selected. If input_path is "-", input is read from stdin. With --nproc > 1 and a file, ZMWs are partitioned across processes.'
+    help_dedup = 'Drops reads whose sequence exactly matches an earlier read (by md5), of this input; with --digests-fn, also a read of the earlier inputs deduplicated into the same digests file (e.g. a movie listed twice in a FOFN). With --max-mem, digests beyond that budget are spilled to disk. If input_path is "-", input is read from stdin (and spooled under $TMPDIR).'
 
     parser_pass = subparsers.add_parser('pass',
             formatter_class=HelpF,
@@ -220,7 +1005,27 @@ def parse_args(argv):
             help=help_streamed_internal_median)
     parser_streamed_internal_median.set_defaults(func=cmd_run_streamed_internal_median_filter)
 
+    parser_dedup = subparsers.add_parser('dedup',
+            formatter_class=HelpF,
+            description=help_dedup,
+            help=help_dedup)
+    parser_dedup.set_defaults(func=cmd_run_dedup_filter)
+
     parser.add_argument('input_path', help='Input PacBio FASTA file')
+    parser.add_argument('--nproc', type=int, default=1,
+            help='Number of worker processes, for filters which support it (see each sub-command).')
+    parser.add_argument('--max-mem', type=int, default=0,
+            help='For dedup: spill sequence digests to disk beyond about this many MB. For the streamed filters: group subreads by ZMW with an external merge-sort using about this many MB, so the input need not be grouped by ZMW. The input is spooled under $TMPDIR. 0 means group consecutive subreads in memory. For --order: sort externally beyond about this many MB.')
+    parser.add_argument('--digests-fn',
+            help='For dedup: a file of the sequence digests of the reads written so far, by earlier runs over other inputs. Reads matching one are dropped, and the digests of the reads written are appended. Run one dedup at a time on it, in input order. Default: dedup within input_path only.')
+    parser.add_argument('--order', choices=ORDERS,
+            help='Output the kept reads longest-first ("length"), or dealt across length strata ("interleave"), so that every DB block gets a similar length distribution. Subreads of a ZMW stay together. The output is spooled under $TMPDIR. Default: input order.')
+    parser.add_argument('--columns', type=int, default=FastaReader.FastaRecord.COLUMNS,
+            help='Wrap output sequences at this width. 0 means unwrapped, which is fastest (and fine for fasta2DB).')
+    parser.add_argument('--min-length', type=int, default=0,
+            help='Drop reads shorter than this, after any ZMW selection, so they never reach the DB.')
+    parser.add_argument('--length-histogram',
+            help='Output. JSON histogram of the lengths of the reads kept (longest first).')
 
     args = parser.parse_args(argv[1:])
     return args
@@ -228,7 +1033,16 @@ def parse_args(argv):
 def main(argv=sys.argv):
     args = parse_args(argv)
     logging.basicConfig(level=logging.INFO)
-    args.func(args)
+    args.length_filter = LengthFilter(args.min_length)
+    with FastaReader.FastaWriter(sys.stdout, args.columns) as writer:
+        if args.order:
+            run_ordered(args, writer)
+        else:
+            args.writer = writer
+            args.func(args)
+    args.length_filter.log_summary()
+    if args.length_histogram:
+        args.length_filter.write_histogram(args.length_histogram)
 
 if __name__ == "__main__":  # pragma: no cover
     main(sys.argv)          # pragma: no cover
@@ -223,24 +223,12 @@ class GenomeCoverageError(Exception):
 
 def calc_cutoff_from_reverse_sorted_readlength_counts(rl_counts, target):
     """Return first read_len which gives at least 'target' bases.
+
+    >>> calc_cutoff_from_reverse_sorted_readlength_counts([(5, 1), (3, 2), (1, 1)], 8)
+    3
     """
-    total = sum(pair[0] * pair[1] for pair in rl_counts)
-    subtotal = 0
-    if target > total:
-        msg = 'Not enough reads available for desired genome coverage (bases needed={} > actual={})'.format(
-            target, total)
-        raise GenomeCoverageError(msg)
-    cutoff = 0
-    for (rl, count) in rl_counts:
-        subtotal += rl * count
-        if subtotal >= target:
-            cutoff = rl
-            break
-    else:  # pragma: no cover
-        msg = 'Impossible target (probably a bug): target={target}, subtotal={subtotal}, total={total}'.format(
-            locals())
-        raise Exception(msg)
-    return cutoff
+    from length_histogram import LengthHistogram
+    return LengthHistogram.from_pairs(rl_counts).cutoff(target)
 
 
 def num2int(num):
@@ -259,27 +247,16 @@ def get_reverse_sorted_readlength_counts_from_DBstats(DBstats_output):
     ->
     [(169514, 1), ...]
     """
-    rl_counts = list()
-    lines = DBstats_output.splitlines()
-    re_stat = re.compile(
-        r'^\s*(?P<bin>\S+):\s+(?P<count>\S+)\s+\S+\s+\S+\s+\S+\s*$')
-    for line in lines:
-        match = re_stat.search(line)
-        if not match:
-            continue
-        rl = num2int(match.group('bin'))
-        count = num2int(match.group('count'))
-        rl_counts.append((rl, count))
-    return rl_counts
+    from length_histogram import LengthHistogram
+    return LengthHistogram.from_DBstats(DBstats_output).pairs()
 
 
 def calc_cutoff(target, DBstats_output):
     """Calculate the length_cutoff needed for at least 'target' bases.
-    DBstats_output: ASCII output of 'DBstats -b1 DB',
+    DBstats_output: ASCII output of 'DBstats -b1 DB', as text or lines
     """
-    rl_counts = get_reverse_sorted_readlength_counts_from_DBstats(
-        DBstats_output)
-    return calc_cutoff_from_reverse_sorted_readlength_counts(rl_counts, target)
+    from length_histogram import LengthHistogram
+    return LengthHistogram.from_DBstats(DBstats_output).cutoff(target)
 
 
 def parse_2columns_of_ints(data):
@@ -308,44 +285,25 @@ def weighted_average(cols):
 
 
 def parsed_readlengths_from_dbdump_output(output):
-    """Given output text from the DBump command,
+    """Given output text (or lines) from the DBump command,
     yield all read-lengths.
     """
-    re_length = re.compile('^L\s+\d+\s+(\d+)\s+(\d+)$')
-    for line in output.splitlines():
-        mo = re_length.search(line)
-        if mo:
-            beg, end = mo.group(1, 2)
-            beg = int(beg)
-            end = int(end)
-            yield end - beg
+    from length_histogram import read_lengths_from_dbdump
+    for length in read_lengths_from_dbdump(output)[1].tolist():
+        yield length
 
 
 def mapped_readlengths_from_dbdump_output(output):
-    """Given output text from the DBump command,
+    """Given output text (or lines) from the DBump command,
     return dict of (id => read-length).
     There will be alternate lines like these:
       R #
       L # # #
     https://dazzlerblog.wordpress.com/command-guides/dazz_db-command-guide/
     """
-    lengths = dict()
-    re_rid = re.compile('^R\s+(\d+)$')
-    re_length = re.compile('^L\s+(\d+)\s+(\d+)\s+(\d+)$')
-    for line in output.splitlines():
-        mo = re_rid.search(line)
-        if mo:
-            idx = int(mo.group(1))
-            continue
-        mo = re_length.search(line)
-        if mo:
-            well, beg, end = mo.group(1, 2, 3)
-            well = int(idx)
-            beg = int(beg)
-            end = int(end)
-            lengths[idx] = (end - beg)
-            continue
-    return lengths
+    from length_histogram import read_lengths_from_dbdump
+    ids, lengths = read_lengths_from_dbdump(output)
+    return dict(zip(ids.tolist(), lengths.tolist()))
 
 
 def average_difference(dictA, dictB):
@@ -372,8 +330,51 @@ def calc_metric_truncation(dbdump_output, length_pairs_output):
     # """perl -e 'while (<>) { if ( m{>[^/]+/0*(\d+)\d/(\d+)_(\d+)} ) { $lengths{$1} += ($3 - $2); } }; while (my ($k, $v) = each %%lengths) { print "$k $v\n"; };' %s""" %(fastas)
     cols = tuple(parse_2columns_of_ints(length_pairs_output))
     pread_lengths = dict((k, v) for (k, v) in cols)
-    orig_lengths = mapped_readlengths_from_dbdump_output(dbdump_output)
-    avg = -average_difference(pread_lengths, orig_lengths)
+    return average_truncation(list(pread_lengths.keys()), list(pread_lengths.values()), dbdump_output)
+
+
+def average_truncation(pread_ids, pread_lengths, dbdump_lines):
+    """Return the average of (original read-length - total pread-length),
+    over the given pread ids, with original lengths streamed from DBdump.
+    If an id is missing from the DBdump, raise KeyError.
+    """
+    import numpy as np
+    from length_histogram import dbdump_lengths_by_id
+    pread_ids = np.asarray(pread_ids, dtype=np.int64)
+    pread_lengths = np.asarray(pread_lengths, dtype=np.int64)
+    orig_lengths, present = dbdump_lengths_by_id(dbdump_lines)
+    found = pread_ids < len(present)
+    found[found] = present[pread_ids[found]]
+    if not found.all():
+        raise KeyError(int(pread_ids[~found][0]))
+    return -float((pread_lengths - orig_lengths[pread_ids]).mean())
+
+
+def calc_metric_fragmentation_from_fastas(fns):
+    """Same as calc_metric_fragmentation() of the old perl counts,
+    but from an in-process pass over the FASTA headers.
+    """
+    from length_histogram import fragment_counts_from_headers, yield_fasta_headers
+    return weighted_average(fragment_counts_from_headers(yield_fasta_headers(fns)))
+
+
+def calc_metric_truncation_from_fastas(dbdump_lines, fns):
+    """Same as calc_metric_truncation(), but from an in-process pass over
+    the pread FASTA headers, and DBdump lines streamed, e.g. from
+    io_io.StreamedProcessReaderContext('DBdump -rh raw_reads').readlines().
+    """
+    from length_histogram import pread_lengths_from_headers, yield_fasta_headers
+    ids, lengths = pread_lengths_from_headers(yield_fasta_headers(fns))
+    return average_truncation(ids, lengths, dbdump_lines)
+
+
+def calc_metric_truncation_from_db(db, fns):
+    """Stream 'DBdump -rh db' into calc_metric_truncation_from_fastas().
+    """
+    import io_io
+    reader = io_io.StreamedProcessReaderContext('DBdump -rh {}'.format(db))
+    with reader:
+        avg = calc_metric_truncation_from_fastas(reader.readlines(), fns)
     return avg
 
 
@@ -0,0 +1,335 @@
+#! /usr/bin/env python2.7
+"""Multi-threaded gzip decompression.
+
+BGZF files (gzip made of independent <=64KB members, as written by bgzip)
+are inflated block-parallel on a thread pool; zlib releases the GIL, so
+this scales with cores. Plain gzip cannot be split, so it is inflated on
+a single reader thread, which at least overlaps decompression with
+whatever consumes the output.
+
+Either way, the output is delivered in order, as a file-like object.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+from builtins import object
+import argparse
+import collections
+import logging
+import multiprocessing
+import multiprocessing.pool
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+LOG = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+FEXTRA = 0x04
+BGZF_HEADER_SIZE = 18  # fixed header of a BGZF member, through BSIZE
+BATCH_BYTES = 4 * 2**20  # compressed bytes per task on the thread pool
+CHUNK_BYTES = 4 * 2**20  # compressed bytes per read on the gzip thread
+
+
+def default_nproc():
+    return multiprocessing.cpu_count()
+
+
+def is_bgzf(fn):
+    """True if the first member of fn carries the BGZF 'BC' extra subfield.
+    """
+    with open(fn, 'rb') as ifs:
+        header = ifs.read(BGZF_HEADER_SIZE)
+    if len(header) < BGZF_HEADER_SIZE or header[:3] != GZIP_MAGIC:
+        return False
+    flg = ord(header[3:4])
+    xlen, = struct.unpack('<H', header[10:12])
+    return bool(flg & FEXTRA) and xlen >= 6 and header[12:14] == b'BC' and header[14:16] == b'\x02\x00'
+
+
+def yield_bgzf_blocks(ifs, fn='-'):
+    """Yield the raw deflate payload of each BGZF member.
+    """
+    while True:
+        header = ifs.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:3] != GZIP_MAGIC:
+            raise Exception('Invalid BGZF member in {!r} at byte {}'.format(fn, ifs.tell() - len(header)))
+        xlen, = struct.unpack('<H', header[10:12])
+        extra = ifs.read(xlen)
+        bsize = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            si, slen = extra[pos:pos + 2], struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+            if si == b'BC' and slen == 2:
+                bsize, = struct.unpack('<H', extra[pos + 4:pos + 6])
+            pos += 4 + slen
+        if bsize is None:
+            raise Exception('BGZF member without BC subfield in {!r}'.format(fn))
+        # BSIZE is the total member size minus 1; the trailer is CRC32 + ISIZE.
+        rest = ifs.read(bsize + 1 - 12 - xlen)
+        yield rest[:-8]
+
+
+def yield_batches(blocks, max_bytes=BATCH_BYTES):
+    batch = list()
+    nbytes = 0
+    for block in blocks:
+        batch.append(block)
+        nbytes += len(block)
+        if nbytes >= max_bytes:
+            yield batch
+            batch = list()
+            nbytes = 0
+    if batch:
+        yield batch
+
+
+def inflate_batch(batch):
+    return b''.join(zlib.decompress(block, -zlib.MAX_WBITS) for block in batch)
+
+
+def yield_bgzf_chunks(fn, nproc, pool=None):
+    """Inflate BGZF blocks on a thread pool, yielding in file order.
+    At most 2*nproc batches are in flight, to bound memory.
+    pool: a ThreadPool owned by the caller, or None to use our own.
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.pool.ThreadPool(nproc)
+    try:
+        pending = collections.deque()
+        with open(fn, 'rb') as ifs:
+            for batch in yield_batches(yield_bgzf_blocks(ifs, fn)):
+                pending.append(pool.apply_async(inflate_batch, (batch,)))
+                if len(pending) >= 2 * nproc:
+                    yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
+
+
+def yield_gzip_chunks_from_stream(ifs):
+    """Inflate a (possibly multi-member) gzip stream.
+    """
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = ifs.read(CHUNK_BYTES)
+        if not data:
+            break
+        while data:
+            chunk = inflater.decompress(data)
+            if chunk:
+                yield chunk
+            data = inflater.unused_data
+            if data:
+                # Next gzip member.
+                inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunk = inflater.flush()
+    if chunk:
+        yield chunk
+
+
+class ThreadedChunks(object):
+    """Run a chunk generator on a background thread, with a bounded queue.
+    Iterate to get the chunks in order. Exceptions are re-raised here.
+    """
+    _END = object()
+
+    def __init__(self, chunks, maxsize=4):
+        self.queue = queue.Queue(maxsize)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(chunks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, chunks):
+        try:
+            for chunk in chunks:
+                if not self._put(chunk):
+                    return
+            self._put(self._END)
+        except Exception as exc:
+            self._put(exc)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def stop(self):
+        """Stop the producer, and wait for it, so it no longer uses
+        anything the caller is about to release.
+        """
+        self.stopped.set()
+        self.thread.join()
+
+
+def yield_gzip_chunks(fn):
+    with open(fn, 'rb') as ifs:
+        for chunk in yield_gzip_chunks_from_stream(ifs):
+            yield chunk
+
+
+class ChunkReader(object):
+    """A read-only file-like object over an iterator of byte-strings.
+    Enough for FastaReader.yield_fasta_records(), iteration by lines, and copying.
+    """
+
+    def __init__(self, chunks, on_close=None):
+        self._chunks = iter(chunks)
+        self._buf = b''
+        self._pos = 0
+        self._on_close = on_close
+        self.closed = False
+
+    def _next_chunk(self):
+        """Return False at EOF.
+        """
+        for chunk in self._chunks:
+            if chunk:
+                self._buf = chunk
+                self._pos = 0
+                return True
+        self._buf = b''
+        self._pos = 0
+        return False
+
+    def chunks(self):
+        """Yield the rest of the data, in the chunks as they were inflated.
+        """
+        if self._pos < len(self._buf):
+            yield self._buf[self._pos:]
+        self._buf = b''
+        self._pos = 0
+        for chunk in self._chunks:
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(self.chunks())
+        parts = list()
+        while size > 0:
+            avail = len(self._buf) - self._pos
+            if not avail:
+                if not self._next_chunk():
+                    break
+                continue
+            take = min(avail, size)
+            parts.append(self._buf[self._pos:self._pos + take])
+            self._pos += take
+            size -= take
+        return b''.join(parts)
+
+    def readline(self):
+        parts = list()
+        while True:
+            nl = self._buf.find(b'\n', self._pos)
+            if nl >= 0:
+                parts.append(self._buf[self._pos:nl + 1])
+                self._pos = nl + 1
+                break
+            parts.append(self._buf[self._pos:])
+            if not self._next_chunk():
+                break
+        return b''.join(parts)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self._on_close:
+                self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_gzip(fn, nproc=None):
+    """Return a file-like reader of the decompressed contents of fn.
+    nproc: threads for BGZF inflation (default: all cores).
+    """
+    if not nproc:
+        nproc = default_nproc()
+    if is_bgzf(fn):
+        LOG.info('Inflating BGZF {!r} on {} threads'.format(fn, nproc))
+        pool = multiprocessing.pool.ThreadPool(nproc)
+        chunks = ThreadedChunks(yield_bgzf_chunks(fn, nproc, pool))
+
+        def on_close():
+            # Also when the consumer stops early, e.g. 'head' or an exception.
+            chunks.stop()
+            pool.terminate()
+            pool.join()
+        return ChunkReader(chunks, on_close=on_close)
+    else:
+        LOG.info('Inflating gzip {!r} on a reader thread'.format(fn))
+        chunks = ThreadedChunks(yield_gzip_chunks(fn))
+        return ChunkReader(chunks, on_close=chunks.stop)
+
+
+def copy_gzip(fn, ofs, nproc=None):
+    """Like 'zcat fn > ofs'.
+    """
+    with open_gzip(fn, nproc) as reader:
+        for chunk in reader.chunks():
+            ofs.write(chunk)
+
+
+class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
+    pass
+
+
+def parse_args(argv):
+    description = 'Replacement for "zcat", using all cores for BGZF input and a reader thread for plain gzip.'
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=HelpF,
+    )
+    parser.add_argument(
+        '--nproc', type=int, default=0,
+        help='Number of inflater threads for BGZF input. 0 means all cores.',
+    )
+    parser.add_argument('input_paths', nargs='+', help='gzip or BGZF files')
+    args = parser.parse_args(argv[1:])
+    return args
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    for fn in args.input_paths:
+        copy_gzip(fn, stdout, args.nproc)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv)          # pragma: no cover
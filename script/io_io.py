@@ -47,7 +47,7 @@ LOG = write_with_pid
 def logstats():
     """This is useful 'atexit'.
     """
-    LOG('maxrss:%9d' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    LOG.info('maxrss:%9d' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
 
 
 def reprarg(arg):
@@ -78,30 +78,30 @@ def run_func(args):
         func_name = repr(func)
     args = args[1:]
     try:
-        LOG('starting %s(%s)' % (func_name, ', '.join(reprarg(a) for a in args)))
+        LOG.info('starting %s(%s)' % (func_name, ', '.join(reprarg(a) for a in args)))
         logstats()
         ret = func(*args)
         logstats()
-        LOG('finished %s(%s)' % (func_name, ', '.join(reprarg(a) for a in args)))
+        LOG.info('finished %s(%s)' % (func_name, ', '.join(reprarg(a) for a in args)))
         return ret
     except Exception:
         raise Exception(traceback.format_exc())
     except:  # KeyboardInterrupt, SystemExit
-        LOG('interrupted %s(%s)' %
+        LOG.info('interrupted %s(%s)' %
             (func_name, ', '.join(reprarg(a) for a in args)))
         return
 
 
 def system(call, check=False):
-    LOG('$(%s)' % repr(call))
+    LOG.info('$(%s)' % repr(call))
     rc = os.system(call)
     msg = "Call %r returned %d." % (call, rc)
     if rc:
-        LOG("WARNING: " + msg)
+        LOG.warning(msg)
         if check:
             raise Exception(msg)
     else:
-        LOG(msg)
+        LOG.info(msg)
     return rc
 
 
@@ -125,7 +125,7 @@ def streamlines(cmd):
     The returned reader will stop yielding when the subproc exits.
     Note: We do not detect a failure in the underlying process.
     """
-    LOG('$ %s |' % cmd)
+    LOG.info('$ %s |' % cmd)
     proc = sp.Popen(shlex.split(cmd), stdout=sp.PIPE)
     return proc.stdout
 
@@ -157,7 +157,7 @@ class ProcessReaderContext(object):
         raise NotImplementedError()
 
     def __enter__(self):
-        LOG('{!r}'.format(self.cmd))
+        LOG.info('{!r}'.format(self.cmd))
         self.proc = sp.Popen(shlex.split(self.cmd), stdout=sp.PIPE, universal_newlines=True)
 
     def __exit__(self, etype, evalue, etb):
@@ -275,7 +275,7 @@ def yield_validated_fns(fofn):
 @contextlib.contextmanager
 def TemporaryDirectory():
     name = tempfile.mkdtemp()
-    LOG('TemporaryDirectory={!r}'.format(name))
+    LOG.info('TemporaryDirectory={!r}'.format(name))
     try:
         yield name
     finally:
@@ -462,3 +462,34 @@ def rm_force(*fns):
     for fn in fns:
         if os.path.exists(fn):
             os.unlink(fn)
+
+
+def symlink(actual, symbolic=None, force=True):
+    """Symlink into cwd, relatively.
+    symbolic name is basename(actual) if not provided.
+    If not force, raise when already exists and does not match.
+    But ignore symlink to self.
+    """
+    symbolic = os.path.basename(actual) if not symbolic else symbolic
+    if os.path.abspath(actual) == os.path.abspath(symbolic):
+        LOG.warning('Cannot symlink {!r} as {!r}, itself.'.format(actual, symbolic))
+        return
+    rel = os.path.relpath(actual)
+    if force:
+        LOG.info('ln -sf {} {}'.format(rel, symbolic))
+        if os.path.lexists(symbolic):
+            if os.readlink(symbolic) == rel:
+                return
+            else:
+                os.unlink(symbolic)
+    else:
+        LOG.info('ln -s {} {}'.format(rel, symbolic))
+        if os.path.lexists(symbolic):
+            if os.readlink(symbolic) != rel:
+                msg = '{!r} already exists as {!r}, not {!r}'.format(
+                        symbolic, os.readlink(symbolic), rel)
+                raise Exception(msg)
+            else:
+                LOG.info('{!r} already points to {!r}'.format(symbolic, rel))
+                return
+    os.symlink(rel, symbolic)
@@ -0,0 +1,323 @@
+"""Read-length histograms, backed by NumPy.
+
+A LengthHistogram holds distinct read-lengths (longest first) with their
+counts, plus prefix sums of reads and bases, so that cutoff, N50, total
+and coverage queries are each a binary search.
+
+It can be filled from FASTA, 'DBstats -b1' text, DBdump lines, a
+Dazzler .idx file (via dazzler.py), or a JSON histogram, without holding
+the raw text in memory.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+from builtins import object
+from functional import GenomeCoverageError, num2int
+import array
+import dazzler
+import logging
+import re
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+re_DBstats_bin = re.compile(
+    r'^\s*(?P<bin>\S+):\s+(?P<count>\S+)\s+\S+\s+\S+\s+\S+\s*$')
+MAX_BINCOUNT_LENGTH = 2**24  # beyond this, sort instead
+
+def _lines(text_or_lines):
+    """Accept the whole output as one string, or any iterable of lines.
+    """
+    if isinstance(text_or_lines, str):
+        return text_or_lines.splitlines()
+    return text_or_lines
+
+
+def _grown(arr, size):
+    """Return arr, or a copy at least twice as long if it is shorter than size.
+    """
+    if size <= len(arr):
+        return arr
+    bigger = np.zeros(max(size, 2 * len(arr)), dtype=arr.dtype)
+    bigger[:len(arr)] = arr
+    return bigger
+
+
+def dbdump_lengths_by_id(lines):
+    """Stream DBdump output (e.g. from 'DBdump -rh', as a line iterator),
+    with alternating
+      R #
+      L # # #
+    Return (lengths, present): arrays indexed by read id.
+    The arrays are preallocated from the '+ R #' total, if the dump has it,
+    so memory depends only on the number of reads, not the dump text.
+    Without -r there are no 'R' lines, so the 'L' lines are numbered 1, 2, ...
+
+    >>> lengths, present = dbdump_lengths_by_id('+ R 3\\nR 2\\nL 0 0 100\\nR 3\\nL 1 10 40\\n')
+    >>> np.flatnonzero(present).tolist(), lengths[present].tolist()
+    ([2, 3], [100, 30])
+    >>> lengths, present = dbdump_lengths_by_id('+ R 3\\nH 5\\nL 0 0 100\\nL 1 0 200\\nL 2 10 40\\n')
+    >>> np.flatnonzero(present).tolist(), lengths[present].tolist()
+    ([1, 2, 3], [100, 200, 30])
+    """
+    lengths = np.zeros(0, dtype=np.int64)
+    present = np.zeros(0, dtype=bool)
+    rid = 0
+    numbered = False  # True once an 'R' line is seen
+    for line in _lines(lines):
+        if line.startswith('L'):
+            words = line.split()
+            if len(words) == 4:
+                if not numbered:
+                    rid += 1
+                lengths = _grown(lengths, rid + 1)
+                present = _grown(present, rid + 1)
+                lengths[rid] = int(words[3]) - int(words[2])
+                present[rid] = True
+        elif line.startswith('R'):
+            rid = int(line.split()[1])
+            numbered = True
+        elif line.startswith('+ R'):
+            total = int(line.split()[2]) + 1  # ids are 1-based
+            lengths = _grown(lengths, total)
+            present = _grown(present, total)
+    return lengths, present
+
+
+def read_lengths_from_dbdump(lines):
+    """Given DBdump output (text or lines), as in dbdump_lengths_by_id(),
+    return (read ids, read-lengths) as arrays.
+    """
+    lengths, present = dbdump_lengths_by_id(lines)
+    ids = np.flatnonzero(present)
+    return ids, lengths[ids]
+
+
+# From the perl one-liners formerly used for pre-assembly stats:
+#   m{>[^/]+/(\d+)\d/}  and  m{>[^/]+/0*(\d+)\d/(\d+)_(\d+)}
+re_fragment_id = re.compile(r'^[^/]+/(\d+)\d/')
+re_truncation_id = re.compile(r'^[^/]+/0*(\d+)\d/(\d+)_(\d+)')
+
+
+def fragment_counts_from_headers(names):
+    """Given FASTA headers (without '>'), count the reads of each id,
+    then the ids with each number of reads.
+    Return [(number of ids, reads per id), ...], as the old perl printed them.
+    """
+    ids = array.array('l')
+    for name in names:
+        mo = re_fragment_id.search(name)
+        if mo:
+            ids.append(int(mo.group(1)))
+    if not ids:
+        return []
+    _, reads_per_id = np.unique(np.frombuffer(ids, dtype=np.dtype(ids.typecode)), return_counts=True)
+    nids = np.bincount(reads_per_id)
+    per = np.flatnonzero(nids)
+    return list(zip(nids[per].tolist(), per.tolist()))
+
+
+def pread_lengths_from_headers(names):
+    """Given pread FASTA headers (without '>'), sum the lengths
+    ('/start_end') of the preads of each id.
+    Return (ids, total lengths) as arrays.
+    """
+    ids = array.array('l')
+    lengths = array.array('l')
+    for name in names:
+        mo = re_truncation_id.search(name)
+        if mo:
+            ids.append(int(mo.group(1)))
+            lengths.append(int(mo.group(3)) - int(mo.group(2)))
+    if not ids:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    ids = np.frombuffer(ids, dtype=np.dtype(ids.typecode))
+    totals = np.bincount(ids, weights=np.frombuffer(lengths, dtype=np.dtype(lengths.typecode)))
+    unique_ids = np.unique(ids)
+    return unique_ids.astype(np.int64), totals[unique_ids].astype(np.int64)
+
+
+def yield_fasta_headers(fns):
+    """Yield the header (without '>') of every record, from plain or .gz FASTA files.
+    """
+    import FastaReader
+    for fn in fns:
+        with FastaReader.open_fasta_reader(fn, log=LOG.debug, mmap=True) as reader:
+            for record in reader:
+                yield record.name
+
+
+class LengthHistogram(object):
+    """Counts of reads by length, longest first.
+
+    >>> h = LengthHistogram.from_lengths([5, 3, 3, 1])
+    >>> h.pairs()
+    [(5, 1), (3, 2), (1, 1)]
+    >>> h.cutoff(8), h.n50(), h.total_bases, h.reads_at_least(2)
+    (3, 3, 12, 3)
+    """
+
+    def __init__(self, lengths, counts):
+        """lengths: distinct read-lengths, in decreasing order
+        counts: number of reads of each length
+        """
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.cum_reads = np.cumsum(self.counts)
+        self.cum_bases = np.cumsum(self.lengths * self.counts)
+
+    @classmethod
+    def from_lengths(cls, lengths):
+        lengths = np.asarray(lengths)
+        if lengths.dtype.kind not in 'iu':
+            lengths = lengths.astype(np.int64)
+        if len(lengths) and 0 <= lengths.min() and lengths.max() < MAX_BINCOUNT_LENGTH:
+            # O(n), vs. the sort in np.unique().
+            counts = np.bincount(lengths)
+            nonzero = np.flatnonzero(counts)[::-1]
+            return cls(nonzero, counts[nonzero])
+        lengths, counts = np.unique(lengths, return_counts=True)
+        return cls(lengths[::-1], counts[::-1])
+
+    @classmethod
+    def from_pairs(cls, rl_counts):
+        """rl_counts: (length, count) pairs, in any order; lengths may repeat.
+        """
+        pairs = np.array(list(rl_counts), dtype=np.int64).reshape(-1, 2)
+        lengths, inverse = np.unique(pairs[:, 0], return_inverse=True)
+        counts = np.bincount(inverse, weights=pairs[:, 1], minlength=len(lengths)).astype(np.int64)
+        return cls(lengths[::-1], counts[::-1])
+
+    @classmethod
+    def from_DBstats(cls, DBstats_output):
+        """DBstats_output: text or lines of 'DBstats -b1 DB'.
+        """
+        def pairs():
+            for line in _lines(DBstats_output):
+                match = re_DBstats_bin.search(line)
+                if match:
+                    yield num2int(match.group('bin')), num2int(match.group('count'))
+        return cls.from_pairs(pairs())
+
+    @classmethod
+    def from_dbdump(cls, lines):
+        """lines: text or lines of DBdump output, with 'L' lines.
+        """
+        return cls.from_lengths(read_lengths_from_dbdump(lines)[1])
+
+    @classmethod
+    def from_idx(cls, fn, trimmed=True):
+        """fn: Dazzler DB (e.g. 'raw_reads.db') or its .idx (e.g. '.raw_reads.idx')
+        """
+        return cls.from_lengths(dazzler.read_lengths(fn, trimmed))
+
+    @classmethod
+    def from_json(cls, fn):
+        """fn: JSON with a 'histogram' of [length, count] pairs, from
+        fasta_filter.py --length-histogram, or an estimate from sample_fasta.py.
+        """
+        import io_io
+        return cls.from_pairs(io_io.deserialize(fn)['histogram'])
+
+    @classmethod
+    def from_fasta(cls, fn, stream=None):
+        """Read-lengths of every record in a FASTA file (or stream, if given).
+        """
+        import FastaReader
+        if stream is None:
+            with FastaReader.open_fasta_reader(fn, log=LOG.debug, mmap=True) as reader:
+                return cls.from_lengths(np.fromiter((rec.length for rec in reader), dtype=np.int64))
+        records = FastaReader.yield_fasta_records_from_blocks(stream, fn, log=LOG.debug)
+        return cls.from_lengths(np.fromiter((len(rec.sequence) for rec in records), dtype=np.int64))
+
+    def pairs(self):
+        """Return [(length, count), ...], longest first,
+        as get_reverse_sorted_readlength_counts_from_DBstats().
+        """
+        return list(zip(self.lengths.tolist(), self.counts.tolist()))
+
+    @property
+    def nreads(self):
+        return int(self.cum_reads[-1]) if len(self.cum_reads) else 0
+
+    @property
+    def total_bases(self):
+        return int(self.cum_bases[-1]) if len(self.cum_bases) else 0
+
+    def cutoff(self, target):
+        """Return the longest read-length such that reads at least that long
+        give at least 'target' bases.
+        """
+        total = self.total_bases
+        if target > total:
+            msg = 'Not enough reads available for desired genome coverage (bases needed={} > actual={})'.format(
+                target, total)
+            raise GenomeCoverageError(msg)
+        i = int(np.searchsorted(self.cum_bases, target, side='left'))
+        return int(self.lengths[i])
+
+    def nx(self, x=50):
+        """N50 (by default): the length L such that reads of at least L hold x% of the bases.
+        """
+        if not self.total_bases:
+            return 0
+        return self.cutoff(self.total_bases * x / 100)
+
+    def n50(self):
+        return self.nx(50)
+
+    def _index_at_least(self, length):
+        # lengths are decreasing, so search the negated (increasing) array.
+        return int(np.searchsorted(-self.lengths, -length, side='right'))
+
+    def reads_at_least(self, length):
+        i = self._index_at_least(length)
+        return int(self.cum_reads[i - 1]) if i else 0
+
+    def bases_at_least(self, length):
+        i = self._index_at_least(length)
+        return int(self.cum_bases[i - 1]) if i else 0
+
+    def coverage(self, genome_size, cutoff=0):
+        """Coverage of the genome by reads of at least 'cutoff'.
+        """
+        return self.bases_at_least(cutoff) / genome_size
+
+    def cutoffs(self, targets):
+        """Vectorized cutoff(): one binary search for all targets.
+        Return an array of cutoffs, with -1 where a target exceeds total_bases.
+        """
+        targets = np.asarray(targets)
+        i = np.searchsorted(self.cum_bases, targets, side='left')
+        ok = i < len(self.lengths)
+        result = np.full(len(targets), -1, dtype=np.int64)
+        result[ok] = self.lengths[i[ok]]
+        return result
+
+    def sweep(self, genome_size, coverages):
+        """Return a row per desired coverage: the length_cutoff which gives it,
+        and the reads/bases/coverage actually kept at that cutoff.
+        length_cutoff is None if there are not enough bases.
+        """
+        targets = (np.asarray(coverages, dtype=float) * genome_size).astype(np.int64)
+        cutoffs = self.cutoffs(targets)
+        rows = list()
+        for coverage, target, cutoff in zip(coverages, targets.tolist(), cutoffs.tolist()):
+            row = dict(seed_coverage=coverage, target_bases=target, length_cutoff=None)
+            if cutoff >= 0:
+                bases = self.bases_at_least(cutoff)
+                row.update(length_cutoff=cutoff, reads=self.reads_at_least(cutoff),
+                           bases=bases, coverage=bases / genome_size)
+            rows.append(row)
+        return rows
+
+    def curve(self, genome_size):
+        """Return the full coverage-vs-cutoff curve: a row per distinct read-length,
+        longest first, with the reads/bases/coverage of reads at least that long.
+        """
+        coverages = self.cum_bases / genome_size
+        return [dict(length_cutoff=length, reads=reads, bases=bases, coverage=coverage)
+                for (length, reads, bases, coverage) in zip(
+                    self.lengths.tolist(), self.cum_reads.tolist(),
+                    self.cum_bases.tolist(), coverages.tolist())]
@@ -2,40 +2,12 @@ import argparse
 import sys
 
 import io_io
+from io_io import symlink
 import os
 import logging
 LOG = logging.getLogger()
 WAIT = 20
 
-def symlink(actual, symbolic=None, force=True):
-    """Symlink into cwd, relatively.
-    symbolic name is basename(actual) if not provided.
-    If not force, raise when already exists and does not match.
-    But ignore symlink to self.
-    """
-    symbolic = os.path.basename(actual) if not symbolic else symbolic
-    if os.path.abspath(actual) == os.path.abspath(symbolic):
-        LOG.warning('Cannot symlink {!r} as {!r}, itself.'.format(actual, symbolic))
-        return
-    rel = os.path.relpath(actual)
-    if force:
-        LOG.info('ln -sf {} {}'.format(rel, symbolic))
-        if os.path.lexists(symbolic):
-            if os.readlink(symbolic) == rel:
-                return
-            else:
-                os.unlink(symbolic)
-    else:
-        LOG.info('ln -s {} {}'.format(rel, symbolic))
-        if os.path.lexists(symbolic):
-            if os.readlink(symbolic) != rel:
-                msg = '{!r} already exists as {!r}, not {!r}'.format(
-                        symbolic, os.readlink(symbolic), rel)
-                raise Exception(msg)
-            else:
-                LOG.info('{!r} already points to {!r}'.format(symbolic, rel))
-                return
-    os.symlink(rel, symbolic)
 
 def ichunked(seq, chunksize):
     """Yields items from an iterator in iterable chunks.
@@ -99,12 +71,6 @@ def parse_args(argv):
     )
 
 
-
-
-
-
-
-
     args = parser.parse_args(argv[1:])
     return args
 
@@ -115,6 +81,5 @@ def main(argv=sys.argv):
     merge_apply(args.las_path,args.las_fn)
 
 
-
 if __name__ == '__main__':  # pragma: no cover
     main()
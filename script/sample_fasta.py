@@ -0,0 +1,332 @@
+#! /usr/bin/env python2.7
+"""Estimate the total bases and read-length histogram of FASTA files
+by sampling byte ranges, in seconds, before any fasta2DB/DBstats.
+
+Each file is cut into equal strata, and one random window is read from
+each. Every record whose '>' falls in a window is parsed (to its end),
+so each record is sampled with probability window/stratum, whatever its
+length. Totals are extrapolated per stratum, with a 95% confidence
+interval from the spread between strata.
+
+- Plain FASTA: windows of the memory-mapped file.
+- BGZF (.gz from bgzip): windows of the compressed file, resynced at the
+  next BGZF member, so the same estimate works without inflating it all.
+- Plain .gz: cannot be entered in the middle, so only a prefix is inflated.
+  That estimate is biased if the file is not homogeneous, and its sampling
+  error is not in the confidence interval ('prefix_files').
+
+Files no bigger than the sample are read entirely (exactly).
+The output JSON has a 'histogram' like fasta_filter.py --length-histogram,
+so calc_cutoff.py --histogram accepts either.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import collections
+import logging
+import math
+import random
+import struct
+import sys
+import zlib
+
+import FastaReader
+import gzip_io
+import io_io
+
+LOG = logging.getLogger()
+
+NWINDOWS = 256  # across all files
+WINDOW_BYTES = 256 * 2**10
+GZIP_PREFIX_BYTES = 16 * 2**20  # compressed bytes to inflate, for plain gzip
+Z95 = 1.96
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+RESYNC_BYTES = 2**17  # BGZF members are at most 64KB
+
+
+class Sample(object):
+    """Records sampled from one file: per window, (weight, read-lengths),
+    where weight is the number of bytes each sampled byte stands for.
+    """
+
+    def __init__(self, fn, nbytes, method):
+        self.fn = fn
+        self.nbytes = nbytes
+        self.method = method  # 'exact', 'windows', 'bgzf', 'gzip-prefix'
+        self.windows = list()
+        self.sampled_bytes = 0
+
+    def add(self, weight, lengths, nbytes):
+        self.windows.append((weight, lengths))
+        self.sampled_bytes += nbytes
+
+    def totals(self):
+        """Return (nreads, nreads variance, nbases, nbases variance).
+        Variance is None if it cannot be estimated (a prefix, or a single window).
+        """
+        reads = [weight * len(lengths) for (weight, lengths) in self.windows]
+        bases = [weight * sum(lengths) for (weight, lengths) in self.windows]
+        k = len(self.windows)
+        if self.method == 'exact':
+            reads_var = bases_var = 0
+        elif self.method == 'gzip-prefix' or k < 2:
+            reads_var = bases_var = None
+        else:
+            # One window per stratum, so treat the strata as a simple random sample of windows.
+            reads_var = k * _variance(reads)
+            bases_var = k * _variance(bases)
+        return sum(reads), reads_var, sum(bases), bases_var
+
+    def weighted_lengths(self):
+        counts = collections.Counter()
+        for weight, lengths in self.windows:
+            for length in lengths:
+                counts[length] += weight
+        return counts
+
+
+def _variance(values):
+    mean = sum(values) / len(values)
+    return sum((val - mean) ** 2 for val in values) / (len(values) - 1)
+
+
+def strata(size, nwindows, window_bytes, rng):
+    """Yield (window start, stratum bytes) for nwindows equal strata of size bytes.
+    """
+    for j in range(nwindows):
+        lo = size * j // nwindows
+        hi = size * (j + 1) // nwindows
+        yield lo + rng.randint(0, max(0, hi - lo - window_bytes)), hi - lo
+
+
+def sample_exact(fn):
+    sample = Sample(fn, io_io.filesize(fn), 'exact')
+    with FastaReader.open_fasta_reader(fn, log=LOG.debug, mmap=True) as reader:
+        sample.add(1.0, [record.length for record in reader], sample.nbytes)
+    return sample
+
+
+def sample_plain(fn, nwindows, window_bytes, rng):
+    size = io_io.filesize(fn)
+    sample = Sample(fn, size, 'windows')
+    with FastaReader.open_mmap(fn) as mapped:
+        for start, stratum in strata(size, nwindows, window_bytes, rng):
+            end = min(size, start + window_bytes)
+            lengths = [view.length for view in FastaReader.yield_views_starting_in(mapped, start, end)]
+            sample.add(stratum / (end - start), lengths, end - start)
+    return sample
+
+
+def find_bgzf_member(ifs, start):
+    """Return the offset of the first BGZF member at or after start, or None.
+    A candidate must be followed by another member (or EOF), to rule out
+    the magic bytes appearing by chance in compressed data.
+    """
+    ifs.seek(0, 2)
+    size = ifs.tell()
+    pos = start
+    while pos < size:
+        ifs.seek(pos)
+        data = ifs.read(RESYNC_BYTES + 18)
+        i = data.find(BGZF_MAGIC)
+        while i >= 0:
+            header = data[i:i + 18]
+            if len(header) == 18 and header[12:14] == b'BC':
+                bsize, = struct.unpack('<H', header[16:18])
+                ifs.seek(pos + i + bsize + 1)
+                following = ifs.read(4)
+                if not following or following == BGZF_MAGIC:
+                    return pos + i
+            i = data.find(BGZF_MAGIC, i + 1)
+        pos += RESYNC_BYTES
+    return None
+
+
+def inflated_window(fn, start, end):
+    """Inflate the BGZF members which start in [start, end) of fn, and then
+    enough more to finish the last record begun in them.
+    Return (text, length of the text from the window's members, compressed bytes read).
+    """
+    with open(fn, 'rb') as ifs:
+        member = find_bgzf_member(ifs, start)
+        if member is None or member >= end:
+            return '', 0, 0
+        ifs.seek(member)
+        blocks = gzip_io.yield_bgzf_blocks(ifs, fn)
+        parts = list()
+        in_window = None
+        for block in blocks:
+            parts.append(zlib.decompress(block, -zlib.MAX_WBITS))
+            if in_window is None:
+                if ifs.tell() >= end:
+                    in_window = sum(len(part) for part in parts)
+                continue
+            if '\n>' in parts[-1] or parts[-1].startswith('>'):
+                break
+        text = ''.join(parts)
+        if in_window is None:
+            in_window = len(text)
+        return text, in_window, ifs.tell() - member
+
+
+def sample_bgzf(fn, nwindows, window_bytes, rng):
+    size = io_io.filesize(fn)
+    sample = Sample(fn, size, 'bgzf')
+    for start, stratum in strata(size, nwindows, window_bytes, rng):
+        end = min(size, start + window_bytes)
+        text, in_window, nbytes = inflated_window(fn, start, end)
+        lengths = [view.length for view in FastaReader.yield_views_starting_in(text, 0, in_window)]
+        sample.add(stratum / (end - start), lengths, nbytes)
+    return sample
+
+
+def sample_gzip_prefix(fn, prefix_bytes):
+    """Inflate the first prefix_bytes (compressed) of a plain gzip file,
+    and extrapolate by compressed bytes.
+    """
+    size = io_io.filesize(fn)
+    sample = Sample(fn, size, 'gzip-prefix')
+    with open(fn, 'rb') as ifs:
+        parts = list()
+        in_prefix = None
+        consumed = 0
+        for chunk in gzip_io.yield_gzip_chunks_from_stream(ifs):
+            parts.append(chunk)
+            if in_prefix is None:
+                if ifs.tell() >= prefix_bytes:
+                    in_prefix = sum(len(part) for part in parts)
+                    consumed = ifs.tell()
+                continue
+            if '\n>' in chunk or chunk.startswith('>'):
+                break
+    text = ''.join(parts)
+    if in_prefix is None:
+        in_prefix, consumed = len(text), size
+    lengths = [view.length for view in FastaReader.yield_views_starting_in(text, 0, in_prefix)]
+    sample.add(size / consumed, lengths, consumed)
+    return sample
+
+
+def sample_file(fn, nwindows, window_bytes=WINDOW_BYTES, rng=None, prefix_bytes=GZIP_PREFIX_BYTES):
+    if rng is None:
+        rng = random.Random(0)
+    size = io_io.filesize(fn)
+    if fn.endswith('.dexta'):
+        raise Exception('Cannot sample {!r}; use undexta first.'.format(fn))
+    if size <= nwindows * window_bytes:
+        return sample_exact(fn)
+    if fn.endswith('.gz'):
+        if gzip_io.is_bgzf(fn):
+            return sample_bgzf(fn, nwindows, window_bytes, rng)
+        if size <= prefix_bytes:
+            return sample_exact(fn)
+        LOG.warning('{!r} is not BGZF, so only its first {} are sampled.'.format(fn, io_io.eng(prefix_bytes)))
+        return sample_gzip_prefix(fn, prefix_bytes)
+    return sample_plain(fn, nwindows, window_bytes, rng)
+
+
+def allocate_windows(sizes, nwindows):
+    """Windows per file, in proportion to size, at least 1 each.
+    >>> allocate_windows([100, 300, 0], 8)
+    [2, 6, 1]
+    """
+    total = sum(sizes) or 1
+    return [max(1, int(round(nwindows * size / total))) for size in sizes]
+
+
+def estimate(fns, nwindows=NWINDOWS, window_bytes=WINDOW_BYTES, seed=0, prefix_bytes=GZIP_PREFIX_BYTES):
+    """Sample the files, and return the estimate as a dict, ready for JSON.
+    """
+    rng = random.Random(seed)
+    sizes = [io_io.filesize(fn) for fn in fns]
+    samples = [sample_file(fn, k, window_bytes, rng, prefix_bytes)
+               for fn, k in zip(fns, allocate_windows(sizes, nwindows))]
+    nreads = nbases = reads_var = bases_var = 0
+    counts = collections.Counter()
+    files = list()
+    for sample in samples:
+        r, r_var, b, b_var = sample.totals()
+        nreads += r
+        nbases += b
+        reads_var += r_var or 0
+        bases_var += b_var or 0
+        counts.update(sample.weighted_lengths())
+        files.append(dict(fn=sample.fn, bytes=sample.nbytes, method=sample.method,
+                          sampled_bytes=sample.sampled_bytes,
+                          sampled_reads=sum(len(lengths) for (_, lengths) in sample.windows),
+                          nreads=int(round(r)), nbases=int(round(b))))
+
+    def ci(total, var):
+        half = Z95 * math.sqrt(var)
+        return [int(max(0, total - half)), int(total + half)]
+    # Round the running total, not each count, so the histogram keeps the estimated totals.
+    histogram = list()
+    cum = rounded = 0
+    for length, count in sorted(counts.items(), reverse=True):
+        cum += count
+        histogram.append([length, int(round(cum)) - rounded])
+        rounded = int(round(cum))
+    return dict(
+        estimated=True,
+        nreads=int(round(nreads)), nreads_ci=ci(nreads, reads_var),
+        nbases=int(round(nbases)), nbases_ci=ci(nbases, bases_var),
+        ci_level=0.95,
+        total_bytes=sum(sizes),
+        sampled_bytes=sum(f['sampled_bytes'] for f in files),
+        sampled_reads=sum(f['sampled_reads'] for f in files),
+        prefix_files=[s.fn for s in samples if s.method == 'gzip-prefix'],
+        files=files,
+        histogram=[pair for pair in histogram if pair[1]],
+    )
+
+
+class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Estimate total bases and the read-length histogram of FASTA files, by sampling byte ranges.',
+        epilog=__doc__,
+        formatter_class=HelpF,
+    )
+    parser.add_argument('--fofn',
+            help='File of FASTA filenames, as for build_db.py (instead of, or as well as, input_paths).')
+    parser.add_argument('--windows', type=int, default=NWINDOWS,
+            help='Number of byte ranges to sample, across all files.')
+    parser.add_argument('--window-kb', type=int, default=WINDOW_BYTES // 2**10,
+            help='Size of each byte range.')
+    parser.add_argument('--gzip-prefix-mb', type=int, default=GZIP_PREFIX_BYTES // 2**20,
+            help='For plain (not BGZF) .gz files: compressed MB to inflate from the start.')
+    parser.add_argument('--seed', type=int, default=0,
+            help='Random seed, for reproducible windows.')
+    parser.add_argument('--out-fn', default='-',
+            help='output. JSON estimate ("-" for stdout).')
+    parser.add_argument('input_paths', nargs='*',
+            help='FASTA files (plain, BGZF or gzip).')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    fns = list(args.input_paths)
+    if args.fofn:
+        fns.extend(io_io.yield_validated_fns(args.fofn))
+    if not fns:
+        raise Exception('No input files.')
+    result = estimate(fns, args.windows, args.window_kb * 2**10, args.seed, args.gzip_prefix_mb * 2**20)
+    LOG.info('Estimated {:,d} reads (95% CI {:,d}-{:,d}), {:,d} bases (95% CI {:,d}-{:,d}), from {} of {}'.format(
+        result['nreads'], result['nreads_ci'][0], result['nreads_ci'][1],
+        result['nbases'], result['nbases_ci'][0], result['nbases_ci'][1],
+        io_io.eng(result['sampled_bytes']), io_io.eng(result['total_bytes'])))
+    if args.out_fn == '-':
+        io_io.write_as_json(sys.stdout, result)
+        sys.stdout.write('\n')
+    else:
+        io_io.serialize(args.out_fn, result)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv)          # pragma: no cover
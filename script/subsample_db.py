@@ -0,0 +1,199 @@
+#! /usr/bin/env python2.7
+"""Subsample a Dazzler DB to a target coverage, before daligner.
+
+Overlap cost grows with the square of coverage, so reads beyond what
+the assembly needs are worth dropping. Between build_db.py and
+build_daligner_jobs.py, choose a subset of the (trimmed) reads:
+
+- 'longest': longest-first, which is just a higher DBsplit -x,
+  so the DB is re-split in place.
+- 'random': a seeded random sample of the reads of at least --floor,
+  written as a read whitelist per input file, and copied into a new DB
+  with 'DBshow -u | fasta2DB'.
+
+Either way, we write a script (like build_db.sh) to apply the choice.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+
+from build_db import filter_DBsplit_option
+from length_histogram import LengthHistogram
+import bash
+import dazzler
+import io_io
+
+LOG = logging.getLogger()
+DAZZLER_DB_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dazzler_db.py')
+
+
+def trimmed_reads(db):
+    """Return (read indices, lengths) of the reads in the trimmed DB,
+    as indices into the untrimmed DB (0-based).
+    """
+    header, reads = dazzler.read_idx(dazzler.db_paths(db)[1])
+    rlen = np.array(reads['rlen'])
+    ids = np.flatnonzero(dazzler.trimmed_mask(header, reads, rlen))
+    return ids, rlen[ids].astype(np.int64)
+
+
+def select_longest(lengths, target):
+    """Return (mask of the longest reads which reach target bases, their minimum length).
+    All reads of the minimum length are kept, as DBsplit -x would.
+    """
+    hist = LengthHistogram.from_lengths(lengths)
+    if target >= hist.total_bases:
+        return np.ones(len(lengths), dtype=bool), int(lengths.min()) if len(lengths) else 0
+    cutoff = hist.cutoff(target)
+    return lengths >= cutoff, cutoff
+
+
+def select_random(lengths, target, floor, seed):
+    """Return a mask of reads of at least floor, drawn in a seeded random order
+    until they reach target bases.
+    """
+    candidates = np.flatnonzero(lengths >= floor)
+    order = np.random.RandomState(seed).permutation(candidates)
+    cum = np.cumsum(lengths[order])
+    n = int(np.searchsorted(cum, target, side='left')) + 1
+    mask = np.zeros(len(lengths), dtype=bool)
+    mask[order[:n]] = True
+    return mask
+
+
+def write_whitelists(db, ids, prefix):
+    """Write the chosen untrimmed read indices of each input file of db,
+    1-based, one per line, as DBshow reads a read-list FILE ('DBshow -u db FILE').
+    fasta2DB needs each input file separately, so split by the files of the .db.
+    Return [(whitelist filename, input file root), ...] for the files with any reads chosen,
+    so the new DB records the same file names (not the movie prologs).
+    """
+    files = dazzler.read_db(db)['files']
+    result = list()
+    first = 0
+    for i, (last, fname, prolog) in enumerate(files):
+        lo, hi = np.searchsorted(ids, [first, last])
+        first = last
+        if lo == hi:
+            continue
+        fn = '{}.{}.reads'.format(prefix, i)
+        np.savetxt(fn, ids[lo:hi] + 1, fmt='%d')
+        result.append((fn, fname))
+    return result
+
+
+def script_longest(db, DBsplit_opt, cutoff):
+    """Re-split db in place, with -x raised to cutoff.
+    """
+    flags = [flag for flag in filter_DBsplit_option(DBsplit_opt).split() if not flag.startswith('-x')]
+    flags.append('-x{}'.format(cutoff))
+    return """
+DBsplit -f {} {}
+""".format(' '.join(flags), db)
+
+
+def script_random(db, new_db, whitelists, DBsplit_opt, DBdust_opt, nreads):
+    """Copy the whitelisted reads of db into new_db, then dust and split it.
+    Fail unless new_db has exactly the nreads chosen.
+    """
+    lines = ['set -o pipefail', 'rm -f {new_db}.db .{new_db}.*'.format(new_db=new_db)]
+    for fn, fname in whitelists:
+        lines.append('DBshow -u {} {} | fasta2DB -v {} -i{}'.format(db, fn, new_db, fname))
+    lines.append('nreads=$(python {} nreads {})'.format(DAZZLER_DB_PY, new_db))
+    lines.append('if [ "$nreads" != {n} ]; then echo "{new_db} has $nreads reads, not the {n} chosen." >&2; exit 1; fi'.format(
+        n=nreads, new_db=new_db))
+    lines.append('DBdust {} {}'.format(DBdust_opt, new_db))
+    lines.append('DBsplit -f {} {}'.format(filter_DBsplit_option(DBsplit_opt), new_db))
+    return '\n' + '\n'.join(lines) + '\n'
+
+
+def subsample(db, genome_size, coverage, mode, floor=0, seed=0,
+              DBsplit_opt='', DBdust_opt='', new_db='sub_reads', prefix='subsample'):
+    """Choose the reads, and return (script, report).
+    """
+    ids, lengths = trimmed_reads(db)
+    target = int(coverage * genome_size)
+    total = int(lengths.sum())
+    report = dict(db=db, mode=mode, genome_size=genome_size, seed_coverage=coverage, target_bases=target,
+                  input_reads=len(lengths), input_bases=total, input_coverage=total / genome_size)
+    if total <= target:
+        LOG.warning('{!r} has only {:.1f}x of the {}x wanted; not subsampling.'.format(
+            db, total / genome_size, coverage))
+        report.update(reads=len(lengths), bases=total, coverage=total / genome_size, db_out=db)
+        return '\n# Coverage is already below the target; nothing to do.\n', report
+    if mode == 'longest':
+        mask, cutoff = select_longest(lengths, target)
+        script = script_longest(db, DBsplit_opt, cutoff)
+        report.update(length_cutoff=cutoff, db_out=db)
+    else:
+        mask = select_random(lengths, target, floor, seed)
+        whitelists = write_whitelists(db, ids[mask], prefix)
+        script = script_random(db, new_db, whitelists, DBsplit_opt, DBdust_opt, int(mask.sum()))
+        report.update(floor=floor, seed=seed, whitelists=[fn for (fn, _) in whitelists], db_out=new_db)
+    bases = int(lengths[mask].sum())
+    report.update(reads=int(mask.sum()), bases=bases, coverage=bases / genome_size)
+    LOG.info('Subsampled {!r} ({}) from {:,d} reads ({:.1f}x) to {:,d} reads ({:.1f}x)'.format(
+        db, mode, len(lengths), total / genome_size, report['reads'], report['coverage']))
+    return script, report
+
+
+def cmd_subsample(args):
+    db = os.path.splitext(args.db_fn)[0]
+    script, report = subsample(db, args.genome_size, args.coverage, args.mode, args.floor, args.seed,
+                               args.DBsplit_opt, args.DBdust_opt, args.new_db, args.prefix)
+    io_io.serialize(args.report_fn, report)
+    with open(args.script_fn, 'w') as ofs:
+        bash.write_sub_script(ofs, script)
+
+
+class HelpF(argparse.RawTextHelpFormatter, argparse.ArgumentDefaultsHelpFormatter):
+    pass
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Choose reads of a Dazzler DB for a target coverage, and write a script to apply the choice.',
+        epilog=__doc__,
+        formatter_class=HelpF,
+    )
+    parser.add_argument('--db-fn', default='raw_reads.db',
+            help='input. Dazzler DB, after DBsplit.')
+    parser.add_argument('--genome-size', type=int, required=True,
+            help='Estimated genome size.')
+    parser.add_argument('--coverage', type=float, required=True,
+            help='Target coverage of the subset.')
+    parser.add_argument('--mode', choices=('longest', 'random'), default='longest',
+            help='Longest reads first (a higher DBsplit -x), or a seeded random sample above --floor (a new DB).')
+    parser.add_argument('--floor', type=int, default=0,
+            help='For "random": only sample reads at least this long (beyond DBsplit -x).')
+    parser.add_argument('--seed', type=int, default=0,
+            help='For "random": random seed, so the subset is reproducible.')
+    parser.add_argument('--DBsplit-opt', default='',
+            help='DBsplit options of the DB, e.g. pa_DBsplit_option.')
+    parser.add_argument('--DBdust-opt', default='',
+            help='For "random": DBdust options for the new DB.')
+    parser.add_argument('--new-db', default='sub_reads',
+            help='For "random": output. The new DB.')
+    parser.add_argument('--prefix', default='subsample',
+            help='For "random": output. Whitelists are <prefix>.<file #>.reads')
+    parser.add_argument('--report-fn', default='subsample.json',
+            help='output. What was chosen: reads, bases and coverage, before and after.')
+    parser.add_argument('--script-fn', default='subsample_db.sh',
+            help='output. Script to apply the choice.')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    cmd_subsample(args)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv)          # pragma: no cover